@@ -7,7 +7,11 @@ import math
 import openmc_depletion_plotter
 import re
 import dot_out_generator
-from dot_out_generator import convert_time_units, get_short_lived_limits, get_long_lived_limit, create_full_run_tallies, get_single_depletion_tallies, get_waste_class, make_flux_file
+from depletion_tools import cached_reduced_chain, integrate_with_decay_fast_path, CoolingCurve
+from shell_models import plot_geometry_views
+from run_trace import span, add_step_runtimes, write_trace
+from stream_postprocess import StreamingReport
+from dot_out_generator import load_inventory, transport_statepoints, convert_time_units, WASTE_CLASSES, create_full_run_tallies, read_statepoint_tallies, tally_precision, get_flux_values, make_flux_file
 
 v = openmc.Material()
 v.add_element('C', 1, percent_type='ao')
@@ -52,6 +56,11 @@ settings = openmc.Settings(
     source = source,
     run_mode = 'fixed source'
 )
+# Batches beyond the first 2 are added until the heat, damage and dose tallies
+# reach target_rel_err
+target_rel_err = 0.01
+settings.trigger_active = True
+settings.trigger_max_batches = 100
 
 
 timesteps_and_source_rates = [
@@ -73,41 +82,31 @@ source_rates = [item[1] for item in timesteps_and_source_rates]
 # VIZ
 color_assignment = {sphere_cell: 'blue', void_cell: 'red'}
 
-plot = geometry.plot(basis='xz', color_by='cell', colors=color_assignment)
-plot.figure.savefig('xz-cell.png')
-
-plot = geometry.plot(basis='xy', color_by='cell',  colors=color_assignment)
-plot.figure.savefig('xy-cell.png')
-
-plot = geometry.plot(basis='yz', color_by='cell',  colors=color_assignment)
-plot.figure.savefig('yz-cell.png')
+with span('geometry plots'):
+    plot_geometry_views(geometry, color_assignment)
 
 #Tallies
 
-chain = openmc.deplete.Chain.from_xml(openmc.config['chain_file'])
-nuclides = [nuclide.name for nuclide in chain.nuclides]
-
-tallies = create_full_run_tallies(sphere_cell)
+tallies = create_full_run_tallies(sphere_cell, rel_err=target_rel_err)
 
 #Deplete
 
 model = openmc.model.Model(geometry, materials, settings, tallies)
 
+with span('chain reduction'):
+    chain_file = cached_reduced_chain(materials, openmc.config['chain_file'], reduce_chain_level=5)
+
 operator = openmc.deplete.Operator(
     model,
     normalization_mode='source-rate',
-    chain_file=openmc.config['chain_file'],
-    reduce_chain_level=5,
-    reduce_chain=True
-)
-
-integrator = openmc.deplete.PredictorIntegrator(
-    operator,
-    timesteps,
-    source_rates=source_rates
+    chain_file=chain_file,
+    reduce_chain=False
 )
 
-integrator.integrate()
+# Transport only for the irradiation step, cooling steps are decay-only. The
+# v.out report and waste_classes.tsv are written step by step while it runs.
+with span('depletion'), StreamingReport('.', 'v.out', material_id=v.id) as stream:
+    integrate_with_decay_fast_path(operator, timesteps, source_rates)
 
 #model.deplete(
 #    timesteps,
@@ -123,75 +122,43 @@ integrator.integrate()
     
         
         
-results = openmc.deplete.Results("depletion_results.h5")
-prev_time = 0
-total_mass = v.get_mass()
-with open('v.out', 'w') as file:
-    for i, time in enumerate(results.get_times(time_units = "h")):
-        
-        # Tallies for each depletion
-        statepoint_file = f"openmc_simulation_n{i}.h5"
-        damage_energy, heat_energy, dose_rate = get_single_depletion_tallies(statepoint_file)
-            
-        # Composition for each depletion
-        d_time = time - prev_time
-        prev_time = time
-        converted_d_time, converted_d_time_unit = convert_time_units(d_time)
-        converted_time, converted_time_unit = convert_time_units(time)
-        print(f"\nDepletion step {i}. Time interval: {converted_d_time} {converted_d_time_unit}. Total time elapsed: {converted_time} {converted_time_unit}.", file = file)
-        
-        print("Nuclide   Atoms         Mass (grams)     Activity (Bq)  g-Energy (eV)  half life", file = file)
-        long_lived_concentration = 0;
-        short_lived_concentration_A = 0;
-        short_lived_concentration_B = 0;
-        short_lived_concentration_C = 0;
-        for nuc in nuclides:
-            try:
-                 # Get the number of atoms for the nuclide at this depletion step
-                _, num_atoms = results.get_atoms(v, nuc)
-                
-                if num_atoms[i] > 0:
-                    mass_grams = (openmc.data.atomic_mass(nuc) * num_atoms[i]) / 6.02214076e23
-                    activity = openmc.data.decay_constant(nuc) * num_atoms[i]
-                    if openmc.data.decay_photon_energy(nuc) is not None:
-                        g_energy_eV = openmc.data.decay_photon_energy(nuc).integral() * num_atoms[i]
-                    else:
-                        g_energy_eV = 0
-                    h_life = openmc.data.half_life(nuc)
-                    h_life_text = "Stable"
-                    if h_life != None:
-                        h_life_num, h_life_unit = convert_time_units(h_life)
-                        h_life_text = str(f"{h_life_num:3g}{h_life_unit}")
-                    space1 = " " * (10-len(nuc))
-                    space2 = " " * (14-len(str(f"{num_atoms[i]:5g}")))
-                    space3 = " " * (17-len(str(f"{mass_grams:4g}")))
-                    space4 = " " * (15-len(str(f"{activity:3g}")))
-                    space5 = " " * (15-len(str(f"{g_energy_eV:3g}")))
-                    print(f"{nuc}{space1}{num_atoms[i]:5g}{space2}{mass_grams:4g}{space3}{activity:3g}{space4}{g_energy_eV:3g}{space5}{h_life_text}", file = file)
-                    activity_bq_per_cm_3 = activity / v.volume
-                    activity_cu_per_m_3 = (activity_bq_per_cm_3 / 3.7e10) * 1e6
-                    long_lived_limit = get_long_lived_limit(nuc)
-                    sll_A, sll_B, sll_C = get_short_lived_limits(nuc)
-                    if sll_A > 0:
-                        contribution = activity_cu_per_m_3 / sll_A
-                        if contribution > 0:
-                            short_lived_concentration_A += contribution
-                    if sll_B > 0:
-                        contribution = activity_cu_per_m_3 / sll_B
-                        if contribution > 0:
-                            short_lived_concentration_B += contribution
-                    if sll_C > 0:
-                        contribution = activity_cu_per_m_3 / sll_C
-                        if contribution > 0:
-                            short_lived_concentration_C += contribution
-                    if long_lived_limit > 0:
-                        long_lived_contribution = activity_cu_per_m_3 / long_lived_limit
-                        if long_lived_contribution > 0:
-                            long_lived_concentration += long_lived_contribution
-            except Exception as e:
-                pass
-        waste_class = get_waste_class(short_lived_concentration_A, short_lived_concentration_B, short_lived_concentration_C, long_lived_concentration)
-        print(f"Nuclear waste classification: {waste_class}\n", file = file)
+with span('results loading'):
+    times, atoms, nuclide_index, volume = load_inventory("depletion_results.h5", material_id=v.id)
+
+# Tallies for each transport step
+transport_steps, statepoint_files = transport_statepoints(source_rates)
+with span('statepoint reads'):
+    tally_values = read_statepoint_tallies(statepoint_files, ('damage_energy', 'heat', 'dose_rate'))
+damage_energy = tally_values['damage_energy'][0][:, 0]
+heat_energy = tally_values['heat'][0][:, 0]
+dose_rate = tally_values['dose_rate'][0][:, 0]
+precision, batches = tally_precision(statepoint_files)
+for k, i in enumerate(transport_steps):
+    print(f"Step {i}: damage energy {damage_energy[k]}, heat energy {heat_energy[k]}, dose rate {dose_rate[k]}")
+    print(f"    {batches[k]} batches, relative error " + ", ".join(f"{name} {rel_err[k]:.2%}" for name, rel_err in precision.items()))
+
+# Composition and classification for each depletion
+fractions, waste_classes = stream.fractions, stream.codes
+for i, (slc_a, slc_b, slc_c, llc) in enumerate(fractions):
+    print(f"Step {i}: short lived concentration {slc_a:g}/{slc_b:g}/{slc_c:g}, long lived concentration {llc:g}, class {WASTE_CLASSES[waste_classes[i]]}")
+
+# Cooling time after irradiation until each waste class is reached
+end_of_irradiation = max(i for i, rate in enumerate(source_rates) if rate > 0) + 1
+with span('cooling curve'):
+    cooling_curve = CoolingCurve(operator.chain, list(nuclide_index), atoms[end_of_irradiation], volume)
+    transition_times = cooling_curve.transition_times()
+for waste_class, cooling_time in transition_times.items():
+    if cooling_time is None:
+        print(f"Class {waste_class} not reached")
+    else:
+        converted_time, converted_time_unit = convert_time_units(cooling_time / 3600)
+        print(f"Class {waste_class} reached after {converted_time:g} {converted_time_unit} of cooling")
 
             
-make_flux_file("statepoint.2.h5", "Graphite Sphere Shell Model")
\ No newline at end of file
+# Spectrum of the irradiation step for FISPACT
+with span('flux file'):
+    make_flux_file(get_flux_values("openmc_simulation_n0.h5"), "Graphite Sphere Shell Model")
+
+# Stage timings, when OPENMC_WORK_TRACE is set
+add_step_runtimes(statepoint_files)
+write_trace()
\ No newline at end of file
@@ -0,0 +1,374 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as sla
+import openmc
+import openmc.deplete
+from openmc.deplete.cram import CRAM48
+
+from dot_out_generator import (cache_dir, file_hash, load_inventory, load_decay_table, decay_properties, read_statepoint_file,
+                               waste_limit_matrix, waste_fractions, classify_waste, WASTE_CLASSES)
+from run_trace import traced, span, count
+
+# Path to the chain reduced to what the depletable materials can reach, as
+# Operator(reduce_chain=True) would build it. The reduced chain is exported to
+# the cache directory once per chain file, initial nuclide set and level, so
+# later runs and sweep workers pass it as chain_file with reduce_chain=False
+# instead of parsing and reducing the full chain again.
+@traced
+def cached_reduced_chain(materials, chain_file=None, reduce_chain_level=5):
+    if chain_file is None:
+        chain_file = openmc.config['chain_file']
+    nuclides = sorted({nuc for material in materials if material.depletable for nuc in material.get_nuclides()})
+    path = cache_dir() / f"chain_reduced_{file_hash(chain_file, nuclides, reduce_chain_level)}.xml"
+    count('reduced chain cache hits' if path.exists() else 'reduced chain cache misses')
+    if not path.exists():
+        chain = openmc.deplete.Chain.from_xml(chain_file).reduce(nuclides, reduce_chain_level)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.xml')
+        os.close(fd)
+        chain.export_to_xml(tmp_path)
+        os.replace(tmp_path, path)
+    return str(path)
+
+# Decay-only burnup matrix for a chain, built the same way as
+# Chain.form_matrix with all reaction rates set to zero.
+def decay_matrix(chain):
+    rows, cols, values = [], [], []
+    for i, nuc in enumerate(chain.nuclides):
+        if nuc.half_life is None:
+            continue
+        decay_constant = math.log(2) / nuc.half_life
+        if decay_constant == 0:
+            continue
+        rows.append(i)
+        cols.append(i)
+        values.append(-decay_constant)
+        for decay_type, target, branching_ratio in nuc.decay_modes:
+            branch_val = branching_ratio * decay_constant
+            if branch_val == 0:
+                continue
+            if target is not None and target in chain.nuclide_dict:
+                rows.append(chain.nuclide_dict[target])
+                cols.append(i)
+                values.append(branch_val)
+            # Produce alphas and protons from decay
+            if 'alpha' in decay_type and 'He4' in chain.nuclide_dict:
+                rows.append(chain.nuclide_dict['He4'])
+                cols.append(i)
+                values.append(decay_type.count('alpha') * branch_val)
+            elif 'p' in decay_type and 'H1' in chain.nuclide_dict:
+                rows.append(chain.nuclide_dict['H1'])
+                cols.append(i)
+                values.append(decay_type.count('p') * branch_val)
+    n = len(chain.nuclides)
+    return sp.csc_matrix((values, (rows, cols)), shape=(n, n))
+
+# CRAM48 in incomplete partial fraction form with the LU factors for each pole
+# kept per time step length, so repeated step lengths and any number of
+# materials (columns of n0) share one set of factorizations. With cache=False
+# nothing is kept, for callers that never repeat a step length.
+class DecaySolver:
+    def __init__(self, matrix, cache=True):
+        self.matrix = sp.csc_matrix(matrix, dtype=np.float64)
+        self.identity = sp.identity(self.matrix.shape[0], format='csc')
+        self.cache = cache
+        self._factors = {}
+
+    def factors(self, dt):
+        if dt in self._factors:
+            return self._factors[dt]
+        count('cram factorizations')
+        factors = [
+            (alpha, sla.splu(sp.csc_matrix(dt * self.matrix - theta * self.identity)))
+            for alpha, theta in zip(CRAM48.alpha, CRAM48.theta)
+        ]
+        if self.cache:
+            self._factors[dt] = factors
+        return factors
+
+    def __call__(self, n0, dt):
+        y = np.array(n0, dtype=np.float64)
+        for alpha, lu in self.factors(dt):
+            y += 2 * np.real(alpha * lu.solve(y.astype(np.complex128)))
+        return y * CRAM48.alpha0
+
+# Held while depletion_results.h5 is being written here, so readers in other
+# threads (stream_postprocess) never open it part way through a save
+results_lock = threading.Lock()
+
+# Extends depletion_results.h5 with decay-only steps starting from its last
+# entry, which must be the end-of-irradiation state written with
+# integrate(final_step=False). Rows keep the layout StepResult.save writes:
+# beginning-of-step atoms, [start, end] times, zero source rate and zero
+# reaction rates, plus a final [end, end] row.
+@traced
+def append_decay_steps(results_file, chain, timesteps):
+    solver = DecaySolver(decay_matrix(chain))
+    count('hdf5 opens')
+    with results_lock, h5py.File(results_file, 'r+') as f:
+        columns = {name: group.attrs['atom number index'] for name, group in f['nuclides'].items()}
+        shared = [name for name in columns if name in chain.nuclide_dict]
+        chain_rows = np.array([chain.nuclide_dict[name] for name in shared], dtype=int)
+        result_cols = np.array([columns[name] for name in shared], dtype=int)
+
+        first_row = f['number'].shape[0] - 1
+        start_time = f['time'][first_row, 0]
+        number = f['number'][first_row, 0]
+        x = np.zeros((len(chain.nuclides), number.shape[0]))
+        x[chain_rows] = number[:, result_cols].T
+
+        compositions = []
+        solve_times = []
+        for dt in timesteps:
+            start = time.perf_counter()
+            x = solver(x, dt)
+            solve_times.append(time.perf_counter() - start)
+            step_number = number.copy()
+            step_number[:, result_cols] = x[chain_rows].T
+            compositions.append(step_number)
+
+        n_steps = first_row + len(timesteps) + 1
+        for name in ('number', 'time', 'source_rate', 'eigenvalues', 'reaction rates', 'depletion time'):
+            if name in f:
+                f[name].resize(n_steps, axis=0)
+
+        step_starts = start_time + np.concatenate(([0], np.cumsum(timesteps)))
+        for k in range(len(timesteps) + 1):
+            row = first_row + k
+            if k > 0:
+                f['number'][row] = np.broadcast_to(compositions[k - 1], f['number'].shape[1:])
+                f['eigenvalues'][row] = 0
+                if 'reaction rates' in f:
+                    f['reaction rates'][row] = 0
+            end = step_starts[k + 1] if k < len(timesteps) else step_starts[k]
+            f['time'][row] = [step_starts[k], end]
+            f['source_rate'][row] = 0
+            if 'depletion time' in f:
+                f['depletion time'][row] = solve_times[k] if k < len(timesteps) else 0
+
+# Runs transport-coupled depletion only up to the last step with a nonzero
+# source, then solves every remaining cooling step decay-only in one pass and
+# appends them to the same results file.
+def integrate_with_decay_fast_path(operator, timesteps, source_rates, integrator_class=openmc.deplete.PredictorIntegrator,
+                                   results_file="depletion_results.h5", **integrator_kwargs):
+    if integrator_kwargs.get('timestep_units', 's') != 's':
+        raise ValueError("The decay-only fast path expects timesteps in seconds")
+    irradiation_steps = [i for i, rate in enumerate(source_rates) if rate != 0]
+    n_transport = irradiation_steps[-1] + 1 if irradiation_steps else 1
+
+    integrator = integrator_class(
+        operator,
+        timesteps[:n_transport],
+        source_rates=source_rates[:n_transport],
+        **integrator_kwargs
+    )
+    # No final transport solve; the last entry is the end-of-irradiation state
+    with span('transport-coupled depletion', steps=n_transport):
+        integrator.integrate(final_step=False)
+
+    cooling_steps = list(timesteps[n_transport:])
+    if cooling_steps:
+        with span('decay-only depletion', steps=len(cooling_steps)):
+            append_decay_steps(results_file, operator.chain, cooling_steps)
+
+# Indices of the chain nuclides reachable by decay from `names`, in chain order.
+def decay_closure(chain, names):
+    reached = set()
+    stack = [chain.nuclide_dict[name] for name in names if name in chain.nuclide_dict]
+    while stack:
+        i = stack.pop()
+        if i in reached:
+            continue
+        reached.add(i)
+        for decay_type, target, branching_ratio in chain.nuclides[i].decay_modes:
+            if target is not None and target in chain.nuclide_dict:
+                stack.append(chain.nuclide_dict[target])
+            if 'alpha' in decay_type and 'He4' in chain.nuclide_dict:
+                stack.append(chain.nuclide_dict['He4'])
+            elif 'p' in decay_type and 'H1' in chain.nuclide_dict:
+                stack.append(chain.nuclide_dict['H1'])
+    return np.array(sorted(reached), dtype=int)
+
+# Activity and waste class of an end-of-irradiation inventory at any cooling
+# time. The decay matrix is restricted to the nuclides reachable from the
+# inventory and eigendecomposed once, so n(t) = V exp(lambda t) V^-1 n0 is
+# evaluated for every requested time with one matrix product. Falls back to
+# CRAM48 per time when the eigenvectors are ill-conditioned (nuclides with
+# equal half lives feeding each other); every grid and bisection time is a
+# new step length there, so its factorizations are not cached.
+class CoolingCurve:
+    def __init__(self, chain, nuclides, atoms, volume, max_condition=1e10):
+        nonzero = [nuc for nuc, n in zip(nuclides, atoms) if n > 0]
+        rows = decay_closure(chain, nonzero)
+        self.nuclides = [chain.nuclides[i].name for i in rows]
+        self.volume = volume
+        position = {name: k for k, name in enumerate(self.nuclides)}
+        self.n0 = np.zeros(len(rows))
+        for nuc, n in zip(nuclides, atoms):
+            if nuc in position:
+                self.n0[position[nuc]] = max(n, 0)
+
+        half_lives = np.array([np.nan if chain.nuclides[i].half_life is None else chain.nuclides[i].half_life for i in rows])
+        self.decay_constants = np.where(np.isnan(half_lives), 0.0, math.log(2) / half_lives)
+        self.inverse_limits = waste_limit_matrix(self.nuclides, half_lives)
+
+        self.matrix = decay_matrix(chain)[rows][:, rows].toarray()
+        eigenvalues, eigenvectors = np.linalg.eig(self.matrix)
+        self.use_eigen = np.linalg.cond(eigenvectors) < max_condition
+        if self.use_eigen:
+            self.eigenvalues = eigenvalues.real
+            self.eigenvectors = eigenvectors.real
+            self.coefficients = np.linalg.solve(self.eigenvectors, self.n0)
+        else:
+            self.solver = DecaySolver(self.matrix, cache=False)
+
+    # Atoms of the reduced nuclide set, shape (times, nuclides)
+    def atoms(self, times):
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        if self.use_eigen:
+            growth = np.exp(np.outer(times, self.eigenvalues))
+            return np.clip((growth * self.coefficients) @ self.eigenvectors.T, 0, None)
+        return np.array([self.n0 if t == 0 else self.solver(self.n0, t) for t in times])
+
+    # Total activity (Bq), sums of fractions (times x 4) and class codes
+    def evaluate(self, times):
+        atoms = self.atoms(times)
+        activity = atoms @ self.decay_constants
+        fractions = waste_fractions(atoms, self.decay_constants, self.volume, self.inverse_limits)
+        return activity, fractions, classify_waste(fractions)
+
+    # Cooling time (s) at which the class first drops to `target` (index into
+    # WASTE_CLASSES) or better: located on a log-spaced grid, then bisected.
+    # Returns 0 if it already is and None if it does not happen by max_time.
+    def transition_time(self, target, max_time=1e6*365*24*60*60, n_grid=2000, rtol=1e-6):
+        grid = np.concatenate(([0], np.logspace(0, np.log10(max_time), n_grid)))
+        codes = self.evaluate(grid)[2]
+        below = np.flatnonzero(codes <= target)
+        if len(below) == 0:
+            return None
+        if below[0] == 0:
+            return 0.0
+        low, high = grid[below[0] - 1], grid[below[0]]
+        while high - low > rtol * high:
+            mid = 0.5 * (low + high)
+            if self.evaluate(mid)[2][0] <= target:
+                high = mid
+            else:
+                low = mid
+        return float(high)
+
+    @traced
+    def transition_times(self, **kwargs):
+        return {WASTE_CLASSES[target]: self.transition_time(target, **kwargs) for target in (2, 1, 0)}
+
+# Normalised CCFE-709 spectrum in the target and its total flux (n-cm per
+# source particle), from the domain-filtered shell_spectrum tally summed over
+# its domain bins (e.g. zones). ccfe_tally is not used: it has no filter and is
+# dominated by the flux in the void, which would bias threshold reactions.
+def load_collapse_spectrum(statepoint_file):
+    n_groups = len(openmc.mgxs.GROUP_STRUCTURES['CCFE-709']) - 1
+    spectrum = read_statepoint_file(statepoint_file, ('shell_spectrum',))['shell_spectrum'][0]
+    spectrum = spectrum.reshape(-1, n_groups).sum(axis=0)
+    return spectrum / spectrum.sum(), spectrum.sum()
+
+# One-group microscopic cross sections collapsed with `spectrum`, cached on
+# disk per nuclide. The cache is keyed by the normalised spectrum, group
+# structure, chain file and cross section library; nuclides missing from it
+# are collapsed and merged in, so screening new compositions only pays for
+# nuclides not seen before.
+@traced
+def collapsed_cross_sections(nuclides, spectrum, energies=None, chain_file=None, reactions=None):
+    if energies is None:
+        energies = openmc.mgxs.GROUP_STRUCTURES['CCFE-709']
+    if chain_file is None:
+        chain_file = openmc.config['chain_file']
+    spectrum = np.asarray(spectrum, dtype=float)
+    spectrum_key = hashlib.sha256((spectrum / spectrum.sum()).tobytes() + np.asarray(energies, dtype=float).tobytes()).hexdigest()
+    key = file_hash(chain_file, spectrum_key, reactions, str(openmc.config['cross_sections']))
+    path = cache_dir() / f"micro_xs_{key}.npz"
+
+    cached_nuclides, data = [], None
+    if path.exists():
+        with np.load(path) as cached:
+            cached_nuclides = list(cached['nuclides'])
+            reactions = list(cached['reactions'])
+            data = cached['data']
+
+    missing = [nuc for nuc in nuclides if nuc not in cached_nuclides]
+    if missing:
+        micro = openmc.deplete.MicroXS.from_multigroup_flux(
+            energies=energies,
+            multigroup_flux=spectrum,
+            chain_file=chain_file,
+            nuclides=missing,
+            reactions=reactions
+        )
+        reactions = list(micro.reactions)
+        cached_nuclides += list(micro.nuclides)
+        data = micro.data if data is None else np.concatenate([data, micro.data])
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.npz')
+        with os.fdopen(fd, 'wb') as tmp:
+            np.savez(tmp, nuclides=np.array(cached_nuclides), reactions=np.array(reactions), data=data)
+        os.replace(tmp_path, path)
+
+    rows = [cached_nuclides.index(nuc) for nuc in nuclides]
+    return openmc.deplete.MicroXS(data[rows], list(nuclides), reactions)
+
+# Depletes and classifies many candidate compositions against one saved
+# spectrum with no further transport: one-group reaction rates from
+# collapsed_cross_sections drive an IndependentOperator holding every
+# material, and the waste classes of all materials and steps come from one
+# vectorised pass. Materials without a volume get `volume` (cm^3). Returns
+# the step times, class codes (materials x steps) and sums of fractions.
+@traced
+def screen_materials(materials, spectrum, flux, timesteps, source_rates, volume=None, chain_file=None,
+                     reduce_chain_level=5, directory=None):
+    if chain_file is None:
+        chain_file = openmc.config['chain_file']
+    # Clones, so the caller's materials are not made depletable or given volumes
+    materials = openmc.Materials([material.clone() for material in materials])
+    for material in materials:
+        material.depletable = True
+        if material.volume is None:
+            material.volume = volume
+
+    chain_path = cached_reduced_chain(materials, chain_file, reduce_chain_level)
+    library = {entry['materials'][0] for entry in openmc.data.DataLibrary.from_xml(openmc.config['cross_sections']).libraries
+               if entry['type'] == 'neutron'}
+    nuclides = [nuc.name for nuc in openmc.deplete.Chain.from_xml(chain_path).nuclides if nuc.name in library]
+    micro = collapsed_cross_sections(nuclides, spectrum, chain_file=chain_file)
+
+    operator = openmc.deplete.IndependentOperator(
+        materials,
+        [np.array([flux])] * len(materials),
+        [micro] * len(materials),
+        chain_path,
+        normalization_mode='source-rate'
+    )
+    # Without a directory the run goes in a scratch directory removed afterwards
+    with tempfile.TemporaryDirectory(prefix='flux_collapse_') as scratch:
+        directory = Path(directory or scratch).resolve()
+        results_file = directory / "depletion_results.h5"
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            integrate_with_decay_fast_path(operator, timesteps, source_rates, results_file=results_file)
+        finally:
+            os.chdir(cwd)
+        inventories = [load_inventory(results_file, material_id=material.id, drop_zero=False) for material in materials]
+
+    times, _, nuclide_index, _ = inventories[0]
+    atoms = np.stack([inventory[1] for inventory in inventories])
+    volumes = np.array([inventory[3] for inventory in inventories])[:, None]
+    decay = decay_properties(load_decay_table(chain_file), list(nuclide_index))
+    inverse_limits = waste_limit_matrix(list(nuclide_index), decay['half_life'])
+    fractions = waste_fractions(atoms, decay['decay_constant'], volumes, inverse_limits)
+    return times, classify_waste(fractions), fractions
@@ -1,6 +1,24 @@
-import openmc
-import matplotlib.pyplot as plt
+# openmc and matplotlib are imported inside the functions that use them, so
+# the command line post-processor at the bottom starts without loading them.
+import argparse
 import numpy as np
+import h5py
+import os
+import hashlib
+import importlib.metadata
+import tempfile
+from pathlib import Path
+
+from run_trace import traced, count
+
+DECAY_TABLE_FIELDS = ('decay_constant', 'half_life', 'atomic_mass', 'photon_energy')
+RUN_TALLIES = ('damage_energy', 'heat', 'dose_rate', 'ccfe_tally', 'shell_spectrum')
+TRIGGER_TALLIES = ('heat', 'damage_energy', 'dose_rate')
+WASTE_CLASSES = ("A", "B", "C", "Not generally acceptable for near-surface disposal.")
+SHORT_LIVED_HALF_LIFE = 5 * 365 * 24 * 60 * 60 #seconds
+AVOGADRO = 6.02214076e23
+CCFE_GROUPS = 709
+BQ_PER_CM3_TO_CI_PER_M3 = 1e6 / 3.7e10
 
 def convert_time_units(time):
     if time > 24 * 365:
@@ -10,11 +28,135 @@ def convert_time_units(time):
     else:
         return time, 'h'
     
+# Reads the whole atoms dataset for one material in a single pass instead of
+# calling Results.get_atoms per nuclide per step. Returns the time at the start
+# of each step (seconds), a (steps x nuclides) array of atom counts, a
+# name -> column index and the material volume (cm^3).
+@traced
+def load_inventory(results_file="depletion_results.h5", material_id=None, drop_zero=True):
+    count('hdf5 opens')
+    with h5py.File(results_file, 'r') as f:
+        materials = f['materials']
+        if material_id is None:
+            material_id = next(iter(materials))
+        material = materials[str(material_id)]
+        mat_index = material.attrs['index']
+        volume = material.attrs['volume']
+
+        columns = {name: group.attrs['atom number index'] for name, group in f['nuclides'].items()}
+        names = sorted(columns, key=columns.get)
+        times = f['time'][:, 0]
+        atoms = f['number'][:, 0, mat_index, :]
+
+    atoms = atoms[:, [columns[name] for name in names]]
+    if drop_zero:
+        keep = np.any(atoms > 0, axis=0)
+        atoms = atoms[:, keep]
+        names = [name for name, k in zip(names, keep) if k]
+    nuclide_index = {name: col for col, name in enumerate(names)}
+    return times, atoms, nuclide_index, volume
+    
+def cache_dir():
+    path = Path(os.environ.get('OPENMC_WORK_CACHE', Path.home() / '.cache' / 'openmc_work'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def file_hash(path, *extra):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    for item in extra:
+        digest.update(repr(item).encode())
+    return digest.hexdigest()[:16]
+
+def openmc_version():
+    try:
+        return importlib.metadata.version('openmc')
+    except importlib.metadata.PackageNotFoundError:
+        import openmc
+        return openmc.__version__
+
+# OPENMC_CHAIN_FILE is what openmc.config reads the chain from, so checking it
+# first avoids importing openmc just to find the chain.
+def default_chain_file():
+    if 'OPENMC_CHAIN_FILE' in os.environ:
+        return os.environ['OPENMC_CHAIN_FILE']
+    import openmc
+    return openmc.config['chain_file']
+
+@traced
+def build_decay_table(chain_file):
+    import openmc
+    import openmc.deplete
+    chain = openmc.deplete.Chain.from_xml(chain_file)
+    names = [nuclide.name for nuclide in chain.nuclides]
+    table = {field: np.zeros(len(names)) for field in DECAY_TABLE_FIELDS}
+
+    # decay_photon_energy reads the configured chain, so point it at this one
+    configured_chain = openmc.config.get('chain_file')
+    openmc.config['chain_file'] = chain_file
+    count('nuclide data lookups', len(names))
+    try:
+        for i, nuc in enumerate(names):
+            h_life = openmc.data.half_life(nuc)
+            table['half_life'][i] = np.nan if h_life is None else h_life
+            table['decay_constant'][i] = openmc.data.decay_constant(nuc)
+            try:
+                table['atomic_mass'][i] = openmc.data.atomic_mass(nuc)
+            except Exception:
+                table['atomic_mass'][i] = np.nan
+            photon_energy = openmc.data.decay_photon_energy(nuc)
+            if photon_energy is not None:
+                table['photon_energy'][i] = photon_energy.integral()
+    finally:
+        if configured_chain is not None:
+            openmc.config['chain_file'] = configured_chain
+    table['nuclides'] = np.array(names)
+    return table
+
+# Decay properties for every nuclide in the chain, built once and cached on
+# disk under a hash of the chain file and the openmc version (half lives and
+# masses come from data shipped with openmc).
+@traced
+def load_decay_table(chain_file=None):
+    if chain_file is None:
+        chain_file = default_chain_file()
+    path = cache_dir() / f"decay_table_{file_hash(chain_file, openmc_version())}.npz"
+    if path.exists():
+        count('decay table cache hits')
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+    count('decay table cache misses')
+    table = build_decay_table(chain_file)
+    with tempfile.NamedTemporaryFile(dir=path.parent, suffix='.npz', delete=False) as tmp:
+        np.savez(tmp, **table)
+    os.replace(tmp.name, path)
+    return table
+
+# Aligns the table to a list of nuclide names, e.g. the columns from
+# load_inventory. Nuclides missing from the chain are treated as stable with
+# unknown mass.
+@traced
+def decay_properties(table, nuclides):
+    count('decay table lookups', len(nuclides))
+    index = {name: i for i, name in enumerate(table['nuclides'])}
+    cols = np.array([index.get(nuc, -1) for nuc in nuclides], dtype=int)
+    found = cols >= 0
+    fill = {'decay_constant': 0.0, 'half_life': np.nan, 'atomic_mass': np.nan, 'photon_energy': 0.0}
+    return {field: np.where(found, table[field][cols], fill[field]) for field in DECAY_TABLE_FIELDS}
+    
 def get_short_lived_limits(nuc):
+    import openmc.data
     isotope = nuc;
+    count('nuclide data lookups')
     half_life = openmc.data.half_life(nuc)
-    if half_life is not None and half_life < (5 * 365 * 24 * 60 * 60):
+    if half_life is not None and half_life < SHORT_LIVED_HALF_LIFE:
         isotope = "sub_5_year" #nuclide w/ less than 5 year half life
+    return short_lived_limits_by_isotope(isotope)
+
+def short_lived_limits_by_isotope(isotope):
     A, B, C = 0, 0, 0
     match isotope:
         case "H3":
@@ -73,7 +215,121 @@ def get_long_lived_limit(nuc):
         case _:
             return 0
 
-def create_full_run_tallies(cell):
+# Inverse limits aligned to `nuclides` (0 where a nuclide has no limit), with
+# columns short-lived A, B, C and long-lived, so the sums of fractions for
+# every step are one matrix product.
+def waste_limit_matrix(nuclides, half_lives):
+    inverse_limits = np.zeros((len(nuclides), 4))
+    for i, (nuc, half_life) in enumerate(zip(nuclides, half_lives)):
+        isotope = "sub_5_year" if half_life < SHORT_LIVED_HALF_LIFE else nuc
+        limits = (*short_lived_limits_by_isotope(isotope), get_long_lived_limit(nuc))
+        for j, limit in enumerate(limits):
+            if limit > 0:
+                inverse_limits[i, j] = 1 / limit
+    return inverse_limits
+
+# atoms has nuclides on the last axis, e.g. (steps, nuclides) or
+# (materials, steps, nuclides); volume (cm^3) must broadcast against
+# atoms.shape[:-1], so pass (materials, 1) for the 3D case.
+def waste_fractions(atoms, decay_constants, volume, inverse_limits):
+    activity = np.clip(atoms, 0, None) * decay_constants
+    fractions = activity @ inverse_limits
+    return fractions * (BQ_PER_CM3_TO_CI_PER_M3 / np.asarray(volume, dtype=float)[..., None])
+
+# Same decision as get_waste_class, applied to every entry at once. Returns
+# indices into WASTE_CLASSES.
+def classify_waste(fractions):
+    slc_a, slc_b, slc_c, llc = np.moveaxis(fractions, -1, 0)
+    codes = np.zeros(slc_a.shape, dtype=np.int8)
+    codes[slc_a > 1] = 1
+    codes[slc_b > 1] = 2
+    codes[slc_c > 1] = 3
+    codes[(llc > .1) & (codes < 2)] = 2
+    codes[llc > 1] = 3
+    return codes
+
+def waste_class_names(codes):
+    return np.array(WASTE_CLASSES)[codes]
+
+def format_depletion_step(i, time, prev_time, nuclides, step_atoms, decay, waste_class):
+    d_time = time - prev_time
+    converted_d_time, converted_d_time_unit = convert_time_units(d_time)
+    converted_time, converted_time_unit = convert_time_units(time)
+    lines = [f"\nDepletion step {i}. Time interval: {converted_d_time} {converted_d_time_unit}. Total time elapsed: {converted_time} {converted_time_unit}."]
+    lines.append("Nuclide   Atoms         Mass (grams)     Activity (Bq)  g-Energy (eV)  half life")
+    mass_grams = decay['atomic_mass'] * step_atoms / AVOGADRO
+    activity = decay['decay_constant'] * step_atoms
+    g_energy_eV = decay['photon_energy'] * step_atoms
+    for col in np.flatnonzero(step_atoms > 0):
+        h_life = decay['half_life'][col]
+        h_life_text = "Stable"
+        if not np.isnan(h_life):
+            h_life_num, h_life_unit = convert_time_units(h_life / 3600)
+            h_life_text = f"{h_life_num:3g}{h_life_unit}"
+        lines.append(f"{nuclides[col]:<10}{format(step_atoms[col], '5g'):<14}{format(mass_grams[col], '4g'):<17}"
+                     f"{format(activity[col], '3g'):<15}{format(g_energy_eV[col], '3g'):<15}{h_life_text}")
+    lines.append(f"Nuclear waste classification: {waste_class}\n")
+    return "\n".join(lines) + "\n"
+
+# Writes the .out inventory report for every step and returns the per-step
+# sums of fractions (steps x 4) and waste class codes.
+@traced
+def write_out_report(file, times, atoms, nuclides, decay, volume):
+    inverse_limits = waste_limit_matrix(nuclides, decay['half_life'])
+    fractions = waste_fractions(atoms, decay['decay_constant'], volume, inverse_limits)
+    codes = classify_waste(fractions)
+    times_h = times / 3600
+    prev_time = 0
+    for i, time in enumerate(times_h):
+        file.write(format_depletion_step(i, time, prev_time, nuclides, atoms[i], decay, WASTE_CLASSES[codes[i]]))
+        count('report steps')
+        prev_time = time
+    return fractions, codes
+
+# Inventories of several materials from one results file, e.g. the radial
+# zones of a shell, on a shared nuclide axis: atoms (materials x steps x
+# nuclides) and volumes (materials,).
+def load_zone_inventories(results_file, material_ids):
+    inventories = [load_inventory(results_file, material_id=material_id, drop_zero=False) for material_id in material_ids]
+    times, _, nuclide_index, _ = inventories[0]
+    atoms = np.stack([inventory[1] for inventory in inventories])
+    volumes = np.array([inventory[3] for inventory in inventories])
+    keep = np.any(atoms > 0, axis=(0, 1))
+    nuclides = [name for name, k in zip(nuclide_index, keep) if k]
+    return times, atoms[..., keep], {name: col for col, name in enumerate(nuclides)}, volumes
+
+# Zoned version of write_out_report: the inventory report is written for the
+# whole shell (zones summed, so concentrations are volume-weighted averages)
+# and followed by a table of the class of every zone at every step. Returns
+# the whole-shell codes (steps,) and the zone codes (zones x steps).
+def write_zone_report(file, times, atoms, nuclides, decay, volumes, zone_names=None):
+    if zone_names is None:
+        zone_names = [f"Zone {k}" for k in range(len(volumes))]
+    _, shell_codes = write_out_report(file, times, atoms.sum(axis=0), nuclides, decay, volumes.sum())
+    inverse_limits = waste_limit_matrix(nuclides, decay['half_life'])
+    zone_codes = classify_waste(waste_fractions(atoms, decay['decay_constant'], volumes[:, None], inverse_limits))
+
+    file.write("\nWaste classification by zone (innermost first)\n")
+    file.write(f"{'Step':<6}{'Time':<14}" + "".join(f"{name:<12}" for name in zone_names) + "Whole shell\n")
+    for i, time in enumerate(times / 3600):
+        converted_time, converted_time_unit = convert_time_units(time)
+        classes = "".join(f"{WASTE_CLASSES[code][:3]:<12}" for code in zone_codes[:, i])
+        file.write(f"{i:<6}{f'{converted_time:.4g} {converted_time_unit}':<14}{classes}{WASTE_CLASSES[shell_codes[i]][:3]}\n")
+    return shell_codes, zone_codes
+
+# domain is the target cell, or the target material when the tallies should
+# follow the material wherever it fills the geometry. ccfe_tally is the
+# unfiltered CCFE-709 flux over the whole geometry (void included);
+# shell_spectrum is the same spectrum restricted to the domain, per domain bin
+# with energy varying fastest. With rel_err set, the
+# TRIGGER_TALLIES get a relative error trigger so a run with
+# settings.trigger_active keeps adding batches until every one meets it.
+def create_full_run_tallies(domain, rel_err=None):
+    import openmc
+    if isinstance(domain, openmc.Material):
+        domain_filter = openmc.MaterialFilter([domain])
+    else:
+        domain_filter = openmc.CellFilter(domain)
     
     energy_filter = openmc.EnergyFilter.from_group_structure('CCFE-709')
     ccfe_tally = openmc.Tally(name="ccfe_tally")
@@ -81,46 +337,103 @@ def create_full_run_tallies(cell):
     ccfe_tally.scores.append('flux')
     tallies = openmc.Tallies([ccfe_tally])
 
+    spectrum_tally = openmc.Tally(name="shell_spectrum")
+    spectrum_tally.filters = [domain_filter, energy_filter]
+    spectrum_tally.scores = ['flux']
+    tallies.append(spectrum_tally)
+
     dose_tally = openmc.Tally(name="dose_rate")
-    dose_tally.filters = [openmc.CellFilter(cell)]
+    dose_tally.filters = [domain_filter]
     dose_tally.scores = ['flux']
     dose_tally.nuclides = ['total']
     tallies.append(dose_tally)
 
     heat_tally = openmc.Tally(name='heat')
-    heat_tally.filters = [openmc.CellFilter(cell)]
+    heat_tally.filters = [domain_filter]
     heat_tally.scores = ['heating']
     tallies.append(heat_tally)
 
     damage_tally = openmc.Tally(name='damage_energy')
-    damage_tally.filters = [openmc.CellFilter(cell)]
+    damage_tally.filters = [domain_filter]
     damage_tally.scores = ['damage-energy']
     tallies.append(damage_tally)
 
+    if rel_err is not None:
+        for tally in tallies:
+            if tally.name in TRIGGER_TALLIES:
+                trigger = openmc.Trigger('rel_err', rel_err)
+                trigger.scores = list(tally.scores)
+                tally.triggers = [trigger]
+
     tallies.export_to_xml()
     return tallies
 
+# Reads named tallies straight from the statepoint datasets without building
+# an openmc.StatePoint. Returns name -> (mean, std_dev, n_realizations) with
+# the filter/nuclide/score bins flattened.
+@traced
+def read_statepoint_file(statepoint_file, tally_names=RUN_TALLIES):
+    values = {}
+    count('hdf5 opens')
+    with h5py.File(statepoint_file, 'r') as f:
+        groups = {}
+        for key, group in f['tallies'].items():
+            if key.startswith('tally ') and 'name' in group:
+                groups[group['name'][()].decode()] = group
+        for name in tally_names:
+            if name not in groups:
+                raise KeyError(f"No tally named {name!r} in {statepoint_file}")
+            group = groups[name]
+            n = int(group['n_realizations'][()])
+            # hyperslab reads land contiguous, so the reshapes below are views
+            total = group['results'][..., 0].reshape(-1)
+            total_sq = group['results'][..., 1].reshape(-1)
+            mean = np.zeros_like(total)
+            std_dev = np.zeros_like(total)
+            if n > 0:
+                mean = total / n
+            if n > 1:
+                std_dev = np.sqrt(np.clip(total_sq / n - mean**2, 0, None) / (n - 1))
+            elif n == 1:
+                std_dev[:] = np.nan
+            values[name] = (mean, std_dev, n)
+    return values
+
+# Reads every statepoint and stacks the results, giving name -> (mean,
+# std_dev) arrays of shape (files, bins) and n_realizations of shape (files,).
+# Files are read one after another: h5py serialises every call behind one
+# lock, so a thread pool gains nothing.
+@traced
+def read_statepoint_tallies(statepoint_files, tally_names=RUN_TALLIES):
+    per_file = [read_statepoint_file(sp_file, tally_names) for sp_file in statepoint_files]
+    stacked = {}
+    for name in tally_names:
+        mean = np.stack([values[name][0] for values in per_file])
+        std_dev = np.stack([values[name][1] for values in per_file])
+        n_realizations = np.array([values[name][2] for values in per_file])
+        stacked[name] = (mean, std_dev, n_realizations)
+    return stacked
+
+# Achieved precision of each statepoint: name -> largest relative standard
+# deviation over the tally's bins (files,), NaN where nothing scored, plus the
+# number of realizations (batches) each statepoint ran.
+def tally_precision(statepoint_files, tally_names=TRIGGER_TALLIES):
+    values = read_statepoint_tallies(statepoint_files, tally_names)
+    precision = {}
+    for name, (mean, std_dev, n_realizations) in values.items():
+        rel_err = np.full(mean.shape, np.nan)
+        np.divide(std_dev, np.abs(mean), out=rel_err, where=mean != 0)
+        precision[name] = np.fmax.reduce(rel_err, axis=1)
+    return precision, values[tally_names[0]][2]
+
 def get_single_depletion_tallies(statepoint_file):
-    damage_energy = 0
-    heat_energy = 0
-    dose_rate = 0
-    with openmc.StatePoint(statepoint_file) as sp:
-
-        damage_energy_tally = sp.get_tally(name='damage_energy')
-        if damage_energy_tally.num_realizations > 0:
-            damage_energy = damage_energy_tally.get_values(scores=['damage-energy']).item()
-        print("damage energy: ", damage_energy)
-
-        heat_energy_tally = sp.get_tally(name='heat')
-        if heat_energy_tally.num_realizations > 0:
-            heat_energy = heat_energy_tally.get_values(scores=['heating']).item()
-        print("heat energy: ", heat_energy)
-
-        dose_tally = sp.get_tally(name='dose_rate')
-        if dose_tally.num_realizations > 0:
-            dose_rate = dose_tally.get_values(scores=['flux']).item()
-        print("dose rate: ", dose_rate)
-        
+    values = read_statepoint_file(statepoint_file, ('damage_energy', 'heat', 'dose_rate'))
+    damage_energy = values['damage_energy'][0].item()
+    print("damage energy: ", damage_energy)
+    heat_energy = values['heat'][0].item()
+    print("heat energy: ", heat_energy)
+    dose_rate = values['dose_rate'][0].item()
+    print("dose rate: ", dose_rate)
     return damage_energy, heat_energy, dose_rate
 
 
@@ -143,22 +456,41 @@ def get_waste_class(slc_a, slc_b, slc_c, llc): #short and long lived concentrati
     return waste_class
 
 def get_flux_values(statepoint_file):
-        sp = openmc.StatePoint(statepoint_file)
-        flux_values = sp.get_tally(name='ccfe_tally').get_values(scores=['flux'])
-        sp.close()
-        flux_values_flattened = []
-        for sublist in flux_values:
-            for subsublist in sublist:
-                flux_values_flattened.append(subsublist.item())
-        return flux_values_flattened
-    
-def make_flux_file(flux_values, name):
-    with open("fluxes", 'w') as file:
-        for flux in reversed(flux_values):
-            print(f"{flux:.18e}", file = file)
-        print(name, file = file)
+        return read_statepoint_file(statepoint_file, ('ccfe_tally',))['ccfe_tally'][0]
+
+# CCFE-709 group fluxes per source particle in ascending energy order, with
+# their standard deviations.
+def get_flux_spectrum(statepoint_file, tally_name='ccfe_tally'):
+    mean, std_dev, n_realizations = read_statepoint_file(statepoint_file, (tally_name,))[tally_name]
+    return mean, std_dev
+
+# FISPACT fluxes file contents: group values from high to low energy followed
+# by the label line.
+def format_flux_file(flux_values, name):
+    values = np.char.mod('%.18e', np.asarray(flux_values, dtype=float)[::-1])
+    return "\n".join(values) + f"\n{name}\n"
+
+def make_flux_file(flux_values, name, path="fluxes"):
+    with open(path, 'w') as file:
+        file.write(format_flux_file(flux_values, name))
+
+# Reads the spectra of many statepoints and writes one fluxes file per
+# statepoint to the matching path (e.g. one per sweep case).
+@traced
+def export_flux_files(statepoint_files, paths, names, tally_name='ccfe_tally'):
+    spectra = read_statepoint_tallies(statepoint_files, (tally_name,))[tally_name][0]
+    for spectrum, path, name in zip(spectra, paths, names):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        make_flux_file(spectrum, name, path)
+    return spectra
         
-def plot_flux_histogram(flux_values):
+# Shows the histogram, or saves it to `path` if given
+def plot_flux_histogram(flux_values, path=None):
+    import openmc
+    import matplotlib
+    if path is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
     flux_bins = openmc.EnergyFilter.from_group_structure('CCFE-709').values
     bin_widths = np.diff(flux_bins)
 
@@ -182,4 +514,89 @@ def plot_flux_histogram(flux_values):
     labels = [f"{x:.2e}" for x in flux_bins[::25]]
     plt.xticks(x_positions[::25], labels=labels, rotation=90)
     
-    plt.show()
\ No newline at end of file
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
+
+# Command line post-processing of finished runs, one or many result
+# directories at a time, e.g.
+#   python dot_out_generator.py report runs/*/
+#   python dot_out_generator.py spectrum runs/case_1 --name "Vanadium Ring Model"
+#   python dot_out_generator.py plot runs/case_1 --output flux.png
+# Group fluxes of one of the CCFE-709 tallies summed over its domain bins
+# (e.g. the zones of shell_spectrum) and multiplied by scale, such as the
+# source fraction of a biased or replayed run
+def get_group_fluxes(statepoint_file, tally_name='shell_spectrum', scale=1.0):
+    mean = read_statepoint_file(statepoint_file, (tally_name,))[tally_name][0]
+    return mean.reshape(-1, CCFE_GROUPS).sum(axis=0) * scale
+
+def statepoint_path(directory, step):
+    return Path(directory) / f"openmc_simulation_n{step}.h5"
+
+# Steps with a nonzero source rate and their statepoints. Zero-source steps,
+# and the statepoint written after the last step, come from operator calls
+# that reset the tallies without running transport: they hold no realizations,
+# so only these steps have tallies.
+def transport_statepoints(source_rates, directory='.'):
+    steps = [i for i, rate in enumerate(source_rates) if rate != 0]
+    return steps, [statepoint_path(directory, i) for i in steps]
+
+def report_command(args):
+    table = load_decay_table(args.chain_file)
+    for directory in args.directories:
+        directory = Path(directory)
+        times, atoms, nuclide_index, volume = load_inventory(directory / "depletion_results.h5", args.material_id)
+        nuclides = list(nuclide_index)
+        with open(directory / args.output, 'w') as file:
+            fractions, codes = write_out_report(file, times, atoms, nuclides, decay_properties(table, nuclides), volume)
+        print(f"{directory}: class {WASTE_CLASSES[codes[-1]]} after {len(times)} steps")
+
+def spectrum_command(args):
+    for directory in args.directories:
+        flux_values = get_group_fluxes(statepoint_path(directory, args.step), args.tally, args.scale)
+        make_flux_file(flux_values, args.name, Path(directory) / args.output)
+
+def plot_command(args):
+    for directory in args.directories:
+        flux_values = get_group_fluxes(statepoint_path(directory, args.step), args.tally, args.scale)
+        plot_flux_histogram(flux_values, Path(directory) / args.output)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post-process openmc depletion runs")
+    subparsers = parser.add_subparsers(required=True)
+
+    report = subparsers.add_parser('report', help="inventory and waste classification .out report")
+    report.add_argument('directories', nargs='+')
+    report.add_argument('--material-id', default=None)
+    report.add_argument('--chain-file', default=None)
+    report.add_argument('--output', default='v.out')
+    report.set_defaults(command=report_command)
+
+    spectrum = subparsers.add_parser('spectrum', help="FISPACT fluxes file from one step's statepoint")
+    spectrum.add_argument('directories', nargs='+')
+    spectrum.add_argument('--step', type=int, default=0)
+    spectrum.add_argument('--tally', default='shell_spectrum',
+                          help="shell_spectrum (target only) or ccfe_tally (whole geometry, unfiltered)")
+    spectrum.add_argument('--scale', type=float, default=1.0,
+                          help="source fraction of biased or surface source runs, to give fluxes per emitted neutron")
+    spectrum.add_argument('--name', default="OpenMC Model")
+    spectrum.add_argument('--output', default='fluxes')
+    spectrum.set_defaults(command=spectrum_command)
+
+    plot = subparsers.add_parser('plot', help="flux histogram from one step's statepoint")
+    plot.add_argument('directories', nargs='+')
+    plot.add_argument('--step', type=int, default=0)
+    plot.add_argument('--tally', default='shell_spectrum',
+                      help="shell_spectrum (target only) or ccfe_tally (whole geometry, unfiltered)")
+    plot.add_argument('--scale', type=float, default=1.0,
+                      help="source fraction of biased or surface source runs, to give fluxes per emitted neutron")
+    plot.add_argument('--output', default='flux_histogram.png')
+    plot.set_defaults(command=plot_command)
+
+    args = parser.parse_args(argv)
+    args.command(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+# Appends finished runs to one chunked, gzip-compressed HDF5 archive instead
+# of keeping a full-chain depletion_results.h5 and a statepoint per step for
+# each of them. Everything is stored as appendable 1D columns:
+#
+#   runs/       name, directory, parameters (JSON), step_start, step_stop,
+#               inventory_start, inventory_stop
+#   materials/  run, material_id, volume
+#   steps/      run, step, time, source_rate
+#   nuclides/   name
+#   inventory/  step_row, material_row, nuclide, atoms   (nonzero atoms only)
+#   tallies/<name>/  step_row, bin, mean, std_dev
+#
+# step_row, material_row and nuclide index rows of steps, materials and
+# nuclides, so any run can be pulled back out without touching the others.
+import json
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from dot_out_generator import load_inventory, read_statepoint_file
+from run_trace import traced, count
+
+ARCHIVE_TALLIES = ('damage_energy', 'heat', 'dose_rate', 'ccfe_tally', 'shell_spectrum')
+CHUNK_ROWS = 1 << 16
+STRING = h5py.string_dtype()
+
+def _column(f, path, dtype):
+    if path not in f:
+        return f.create_dataset(path, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(CHUNK_ROWS,),
+                                compression='gzip', compression_opts=4, shuffle=True)
+    return f[path]
+
+def _append(f, path, values, dtype):
+    dataset = _column(f, path, dtype)
+    start = dataset.shape[0]
+    dataset.resize(start + len(values), axis=0)
+    dataset[start:] = values
+    return start
+
+# Row of each name in nuclides/name, appending names not seen before
+def _nuclide_rows(f, names):
+    existing = [name.decode() if isinstance(name, bytes) else name for name in _column(f, 'nuclides/name', STRING)[()]]
+    rows = {name: row for row, name in enumerate(existing)}
+    new = [name for name in names if name not in rows]
+    if new:
+        start = _append(f, 'nuclides/name', new, STRING)
+        rows.update({name: start + k for k, name in enumerate(new)})
+    return np.array([rows[name] for name in names], dtype=np.int32)
+
+def _statepoints(run_dir):
+    return sorted(Path(run_dir).glob('openmc_simulation_n*.h5'), key=lambda path: int(path.stem[19:]))
+
+# Adds the run in run_dir (its depletion_results.h5 for every material and the
+# ARCHIVE_TALLIES found in those of its openmc_simulation_n*.h5 statepoints
+# that ran any realizations) under `name`. parameters is any JSON-serialisable
+# description of the run. With float32, atoms and tally values are stored in
+# single precision; the choice is fixed by the first run written to the
+# archive.
+@traced
+def archive_run(archive_file, run_dir, name=None, parameters=None, float32=False, tally_names=ARCHIVE_TALLIES):
+    run_dir = Path(run_dir)
+    results_file = run_dir / "depletion_results.h5"
+    with h5py.File(results_file, 'r') as f:
+        material_ids = sorted(f['materials'], key=lambda key: f['materials'][key].attrs['index'])
+        source_rate = f['source_rate'][:, 0]
+    inventories = [load_inventory(results_file, material_id=material_id) for material_id in material_ids]
+    times = inventories[0][0]
+
+    values_dtype = np.float32 if float32 else np.float64
+    count('hdf5 opens')
+    with h5py.File(archive_file, 'a') as f:
+        if 'inventory/atoms' in f:
+            values_dtype = f['inventory/atoms'].dtype
+        run = _column(f, 'runs/name', STRING).shape[0]
+
+        step_start = _append(f, 'steps/run', np.full(len(times), run, dtype=np.int32), np.int32)
+        _append(f, 'steps/step', np.arange(len(times), dtype=np.int32), np.int32)
+        _append(f, 'steps/time', times, np.float64)
+        _append(f, 'steps/source_rate', source_rate, np.float64)
+
+        material_start = _append(f, 'materials/run', np.full(len(material_ids), run, dtype=np.int32), np.int32)
+        _append(f, 'materials/material_id', np.array([int(material_id) for material_id in material_ids], dtype=np.int32), np.int32)
+        _append(f, 'materials/volume', np.array([inventory[3] for inventory in inventories]), np.float64)
+
+        inventory_start = _column(f, 'inventory/atoms', values_dtype).shape[0]
+        for k, (_, atoms, nuclide_index, _) in enumerate(inventories):
+            steps, cols = np.nonzero(atoms)
+            nuclide_rows = _nuclide_rows(f, list(nuclide_index))
+            _append(f, 'inventory/step_row', (step_start + steps).astype(np.int64), np.int64)
+            _append(f, 'inventory/material_row', np.full(len(steps), material_start + k, dtype=np.int32), np.int32)
+            _append(f, 'inventory/nuclide', nuclide_rows[cols], np.int32)
+            _append(f, 'inventory/atoms', atoms[steps, cols].astype(values_dtype), values_dtype)
+        inventory_stop = f['inventory/atoms'].shape[0]
+
+        for statepoint_file in _statepoints(run_dir):
+            step = int(statepoint_file.stem[19:])
+            with h5py.File(statepoint_file, 'r') as sp:
+                available = {group['name'][()].decode() for key, group in sp['tallies'].items()
+                             if key.startswith('tally ') and 'name' in group}
+            values = read_statepoint_file(statepoint_file, [name for name in tally_names if name in available])
+            for tally_name, (mean, std_dev, n_realizations) in values.items():
+                # Zero-source steps run no transport and score nothing
+                if n_realizations == 0:
+                    continue
+                group = f'tallies/{tally_name}'
+                _append(f, f'{group}/step_row', np.full(len(mean), step_start + step, dtype=np.int64), np.int64)
+                _append(f, f'{group}/bin', np.arange(len(mean), dtype=np.int32), np.int32)
+                _append(f, f'{group}/mean', mean.astype(values_dtype), values_dtype)
+                _append(f, f'{group}/std_dev', std_dev.astype(values_dtype), values_dtype)
+
+        _append(f, 'runs/name', [name or run_dir.name], STRING)
+        _append(f, 'runs/directory', [str(run_dir)], STRING)
+        _append(f, 'runs/parameters', [json.dumps(parameters or {})], STRING)
+        _append(f, 'runs/step_start', [step_start], np.int64)
+        _append(f, 'runs/step_stop', [step_start + len(times)], np.int64)
+        _append(f, 'runs/inventory_start', [inventory_start], np.int64)
+        _append(f, 'runs/inventory_stop', [inventory_stop], np.int64)
+    return run
+
+# name -> (row, parameters) for every archived run
+def archived_runs(archive_file):
+    with h5py.File(archive_file, 'r') as f:
+        names = f['runs/name'].asstr()[()]
+        parameters = f['runs/parameters'].asstr()[()]
+    return {name: (row, json.loads(params)) for row, (name, params) in enumerate(zip(names, parameters))}
+
+# Inventory of one archived run in load_inventory's form, with the materials
+# stacked: times, atoms (materials x steps x nuclides), nuclide_index and
+# volumes (materials,). Only the run's own slice of the step and inventory
+# columns is read; the short materials/ and nuclides/ columns are read whole.
+def load_archived_inventory(archive_file, run):
+    with h5py.File(archive_file, 'r') as f:
+        if isinstance(run, str):
+            run = list(f['runs/name'].asstr()[()]).index(run)
+        step_start, step_stop = f['runs/step_start'][run], f['runs/step_stop'][run]
+        start, stop = f['runs/inventory_start'][run], f['runs/inventory_stop'][run]
+        times = f['steps/time'][step_start:step_stop]
+        material_rows = np.flatnonzero(f['materials/run'][()] == run)
+        volumes = f['materials/volume'][()][material_rows]
+        step_rows = f['inventory/step_row'][start:stop] - step_start
+        materials = f['inventory/material_row'][start:stop] - material_rows[0]
+        nuclide_rows = f['inventory/nuclide'][start:stop]
+        values = f['inventory/atoms'][start:stop]
+        names = f['nuclides/name'].asstr()[()]
+
+    used, cols = np.unique(nuclide_rows, return_inverse=True)
+    atoms = np.zeros((len(material_rows), len(times), len(used)))
+    atoms[materials, step_rows, cols] = values
+    nuclide_index = {names[row]: col for col, row in enumerate(used)}
+    return times, atoms, nuclide_index, volumes
+
+# name -> (mean, std_dev) of shape (statepoints, bins) for one archived run
+def load_archived_tally(archive_file, run, tally_name):
+    with h5py.File(archive_file, 'r') as f:
+        if isinstance(run, str):
+            run = list(f['runs/name'].asstr()[()]).index(run)
+        step_start, step_stop = f['runs/step_start'][run], f['runs/step_stop'][run]
+        group = f[f'tallies/{tally_name}']
+        step_rows = group['step_row'][()]
+        start, stop = np.searchsorted(step_rows, [step_start, step_stop])
+        steps = step_rows[start:stop] - step_start
+        bins = group['bin'][start:stop]
+        mean = np.zeros((steps.max() + 1 if len(steps) else 0, bins.max() + 1 if len(bins) else 0))
+        std_dev = np.zeros_like(mean)
+        mean[steps, bins] = group['mean'][start:stop]
+        std_dev[steps, bins] = group['std_dev'][start:stop]
+    return mean, std_dev
@@ -0,0 +1,98 @@
+# SQLite index of finished runs: the parameters of every case and, per step,
+# its time, waste class, total activity, heating and damage energy, so
+# questions across a sweep are answered by a query instead of rerunning or
+# re-reading the outputs. run_sweep(catalog=...) records each case as it
+# finishes; record_run takes any summary in run_case's form.
+import sqlite3
+from contextlib import closing
+
+from dot_out_generator import WASTE_CLASSES
+
+YEAR = 365 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    material TEXT,
+    geometry TEXT,
+    thickness REAL,
+    zones INTEGER,
+    schedule TEXT,
+    directory TEXT,
+    recorded TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    step INTEGER NOT NULL,
+    time REAL NOT NULL,
+    class_code INTEGER NOT NULL,
+    waste_class TEXT NOT NULL,
+    activity REAL,
+    heat REAL,
+    damage_energy REAL,
+    PRIMARY KEY (run_id, step)
+);
+CREATE INDEX IF NOT EXISTS runs_material ON runs (material);
+CREATE INDEX IF NOT EXISTS runs_geometry ON runs (geometry, thickness);
+CREATE INDEX IF NOT EXISTS steps_time_class ON steps (time, class_code);
+"""
+
+def connect(catalog_file="run_catalog.sqlite"):
+    connection = sqlite3.connect(catalog_file)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+# Inserts (or replaces, by name) one run and its steps
+def record_run(catalog_file, summary):
+    with closing(connect(catalog_file)) as connection, connection:
+        connection.execute("DELETE FROM runs WHERE name = ?", (summary['name'],))
+        run_id = connection.execute(
+            "INSERT INTO runs (name, material, geometry, thickness, zones, schedule, directory) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (summary['name'], summary.get('material'), summary.get('geometry'), summary.get('thickness'),
+             summary.get('zones', 1), summary.get('schedule'), summary.get('directory'))
+        ).lastrowid
+        n_steps = len(summary['times'])
+        heat = summary.get('heat') or [None] * n_steps
+        damage_energy = summary.get('damage_energy') or [None] * n_steps
+        activity = summary.get('activity') or [None] * n_steps
+        connection.executemany(
+            "INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, i, summary['times'][i], WASTE_CLASSES.index(summary['waste_class'][i]),
+              summary['waste_class'][i], activity[i], heat[i], damage_energy[i]) for i in range(n_steps)]
+        )
+    return run_id
+
+def query(catalog_file, sql, parameters=()):
+    with closing(connect(catalog_file)) as connection:
+        return [dict(row) for row in connection.execute(sql, parameters)]
+
+# Runs that are at `waste_class` or better at every step from `after` seconds
+# on, e.g. runs_staying_in_class("A", 10 * YEAR) for the alloys that stay
+# class A after 10 years.
+def runs_staying_in_class(catalog_file, waste_class="A", after=10 * YEAR):
+    code = WASTE_CLASSES.index(waste_class)
+    return query(catalog_file, """
+        SELECT runs.* FROM runs
+        WHERE EXISTS (SELECT 1 FROM steps WHERE steps.run_id = runs.id AND steps.time >= :after)
+          AND NOT EXISTS (SELECT 1 FROM steps WHERE steps.run_id = runs.id AND steps.time >= :after
+                          AND steps.class_code > :code)
+        ORDER BY runs.name
+    """, {'after': after, 'code': code})
+
+def run_steps(catalog_file, name):
+    return query(catalog_file, """
+        SELECT steps.* FROM steps JOIN runs ON runs.id = steps.run_id
+        WHERE runs.name = ? ORDER BY steps.step
+    """, (name,))
+
+# Filter runs on any of their parameters, e.g. find_runs(geometry='ring')
+def find_runs(catalog_file, **parameters):
+    columns = {'name', 'material', 'geometry', 'thickness', 'zones', 'schedule'}
+    unknown = set(parameters) - columns
+    if unknown:
+        raise ValueError(f"Unknown run parameters: {sorted(unknown)}")
+    where = " AND ".join(f"{column} = :{column}" for column in parameters) or "1"
+    return query(catalog_file, f"SELECT * FROM runs WHERE {where} ORDER BY name", parameters)
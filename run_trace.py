@@ -0,0 +1,131 @@
+# Timing spans and counters for the run scripts and post-processing, written
+# out as a Chrome trace (chrome://tracing or ui.perfetto.dev). Off unless the
+# OPENMC_WORK_TRACE environment variable is set or enable() is called; while
+# off, span() hands back one shared no-op context manager and count() and
+# traced functions return after a single flag check.
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import h5py
+
+_enabled = bool(os.environ.get('OPENMC_WORK_TRACE'))
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_null_span = nullcontext()
+_origin = time.perf_counter_ns()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def reset():
+    global _origin
+    with _lock:
+        _events.clear()
+        _counters.clear()
+        _origin = time.perf_counter_ns()
+
+def _now_us():
+    return (time.perf_counter_ns() - _origin) / 1000
+
+def _record(event):
+    event.setdefault('pid', os.getpid())
+    event.setdefault('tid', threading.get_ident())
+    with _lock:
+        _events.append(event)
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        _record({'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': _now_us() - self.start, 'args': self.args})
+
+def span(name, **args):
+    if not _enabled:
+        return _null_span
+    return _Span(name, args)
+
+# Wraps a function in a span named after it
+def traced(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return fn(*args, **kwargs)
+        with _Span(fn.__qualname__, {}):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def count(name, n=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+        value = _counters[name]
+    _record({'name': name, 'ph': 'C', 'ts': _now_us(), 'args': {name: value}})
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+# Adds the per-step transport timings openmc wrote to each statepoint
+# (runtime/*) and the depletion solve times from depletion_results.h5, laid
+# end to end on their own track since they were measured inside openmc.
+def add_step_runtimes(statepoint_files, results_file="depletion_results.h5"):
+    if not _enabled:
+        return
+    transport = {}
+    for i, statepoint_file in enumerate(statepoint_files):
+        with h5py.File(statepoint_file, 'r') as f:
+            if 'runtime' in f:
+                transport[i] = {name: float(value[()]) for name, value in f['runtime'].items()}
+    depletion_times = []
+    if results_file is not None and os.path.exists(results_file):
+        with h5py.File(results_file, 'r') as f:
+            if 'depletion time' in f:
+                depletion_times = f['depletion time'][()]
+
+    ts = 0.0
+    for i in range(max(len(depletion_times), max(transport, default=-1) + 1)):
+        if i in transport:
+            dur = transport[i].get('total', 0.0) * 1e6
+            _record({'name': f"transport step {i}", 'ph': 'X', 'ts': ts, 'dur': dur, 'args': transport[i],
+                     'pid': 'openmc', 'tid': 'steps'})
+            ts += dur
+        if i < len(depletion_times):
+            dur = float(depletion_times[i]) * 1e6
+            _record({'name': f"depletion solve step {i}", 'ph': 'X', 'ts': ts, 'dur': dur, 'args': {},
+                     'pid': 'openmc', 'tid': 'steps'})
+            ts += dur
+
+def write_trace(path=None):
+    if not _enabled:
+        return None
+    if path is None:
+        path = os.environ.get('OPENMC_WORK_TRACE')
+        if path in (None, '', '1'):
+            path = 'trace.json'
+    with _lock:
+        trace = {'traceEvents': list(_events), 'otherData': {'counters': dict(_counters)}}
+    with open(path, 'w') as file:
+        json.dump(trace, file)
+    return path
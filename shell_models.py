@@ -0,0 +1,236 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import openmc
+
+from dot_out_generator import create_full_run_tallies, cache_dir, file_hash
+
+INNER_RADIUS = 114 #cm
+PLOT_BASES = ('xz', 'xy', 'yz')
+
+def irradiation_schedule(irradiation_time=365*24*60*60, source_rate=1e20):
+    timesteps_and_source_rates = [
+        (irradiation_time, source_rate)
+    ]
+    for i in range(12):
+        timesteps_and_source_rates.append((30*24*60*60, 0))
+    for i in range(9):
+        timesteps_and_source_rates.append((365*24*60*60, 0))
+    for i in range(9):
+        timesteps_and_source_rates.append((10*365*24*60*60, 0))
+    for i in range(9):
+        timesteps_and_source_rates.append((100*365*24*60*60, 0))
+
+    timesteps = [item[0] for item in timesteps_and_source_rates]
+    source_rates = [item[1] for item in timesteps_and_source_rates]
+    return timesteps, source_rates
+
+def point_source():
+    source = openmc.IndependentSource()
+    source.space = openmc.stats.Point((0,0,0))
+    source.angle = openmc.stats.Isotropic()
+    source.energy = openmc.stats.Discrete([14.1e6], [1])
+    source.particles = 'neutron'
+    return source
+
+# Range of polar cosines (about +z) from the origin that hit a ring spanning
+# z from 0 to height at radius inner_rad or beyond.
+def ring_mu_band(inner_rad, height):
+    return 0.0, height / math.hypot(inner_rad, height)
+
+# Point source emitting only into the ring's polar band, and the fraction of
+# an isotropic source that band holds. Outside the band a neutron crosses the
+# void to the vacuum boundary without reaching the ring, so cell-filtered
+# tallies per emitted neutron are the band-only tallies times the fraction;
+# scale source rates (or results) by it. Unfiltered tallies such as
+# ccfe_tally only see the band, so take spectra from the cell-filtered
+# shell_spectrum instead.
+def ring_band_source(inner_rad, height):
+    mu_lo, mu_hi = ring_mu_band(inner_rad, height)
+    source = point_source()
+    source.angle = openmc.stats.PolarAzimuthal(
+        mu=openmc.stats.Uniform(mu_lo, mu_hi),
+        phi=openmc.stats.Uniform(0, 2 * math.pi)
+    )
+    return source, (mu_hi - mu_lo) / 2
+
+# With max_batches set, `batches` becomes the minimum and the run continues
+# in steps of batch_interval until the tally triggers are met or max_batches
+# is reached.
+def fixed_source_settings(source, particles=10000, batches=2, max_batches=None, batch_interval=1):
+    settings = openmc.Settings(
+        batches = batches,
+        inactive = 0,
+        particles = particles,
+        source = source,
+        run_mode = 'fixed source'
+    )
+    if max_batches is not None:
+        settings.trigger_active = True
+        settings.trigger_max_batches = max_batches
+        settings.trigger_batch_interval = batch_interval
+    return settings
+
+# Radial zone boundaries of a shell split into `zones` equal thicknesses
+def zone_radii(inner_rad, thickness, zones):
+    return [inner_rad + k * thickness / zones for k in range(zones + 1)]
+
+# One depletable material per radial zone, so each zone depletes under its
+# own reaction rates. A single zone is `material` itself, as in the unzoned
+# models; with several, every zone gets a named clone and `material` is left
+# untouched.
+def zone_materials(material, volumes):
+    if len(volumes) == 1:
+        materials = [material]
+    else:
+        base_name = material.name or 'shell'
+        materials = [material.clone() for _ in volumes]
+        for k, zone_material in enumerate(materials):
+            zone_material.name = f"{base_name} zone {k}"
+    for zone_material, volume in zip(materials, volumes):
+        zone_material.volume = volume
+        zone_material.depletable = True
+    return materials
+
+# Spherical shell around the point source, reflective on the outside. With
+# zones > 1 the shell is split radially into that many cells, each with its
+# own material and tally bins, and the list of zone cells (innermost first)
+# is returned in place of the shell cell.
+def build_sphere_model(material, thickness=1, inner_rad=INNER_RADIUS, particles=10000, batches=2, rel_err=None,
+                       max_batches=None, zones=1):
+    radii = zone_radii(inner_rad, thickness, zones)
+    volumes = [(4/3) * math.pi * (outer**3 - inner ** 3) for inner, outer in zip(radii[:-1], radii[1:])]
+    materials = openmc.Materials(zone_materials(material, volumes))
+
+    spheres = [openmc.Sphere(r=r) for r in radii]
+    spheres[-1].boundary_type = 'reflective'
+    zone_cells = []
+    for inner, outer, zone_material in zip(spheres[:-1], spheres[1:], materials):
+        cell = openmc.Cell(region=+inner & -outer)
+        cell.fill = zone_material
+        zone_cells.append(cell)
+    void_cell = openmc.Cell(region=-spheres[0])
+    void_cell.fill = None
+    geometry = openmc.Geometry(zone_cells + [void_cell])
+
+    settings = fixed_source_settings(point_source(), particles, batches, max_batches)
+    tallies = create_full_run_tallies(zone_cells, rel_err)
+    return openmc.model.Model(geometry, materials, settings, tallies), zone_cells[0] if zones == 1 else zone_cells
+
+# Sphere model whose shell is split into layers out to max_thickness, all
+# tallied through the material rather than a cell. Setting a layer's fill to
+# None thins the shell without touching the surfaces; because the problem is
+# spherically symmetric, void layers in front of the reflective boundary do
+# not change the result. The layers are filled with a clone of `material`
+# (model.materials[0]), leaving the caller's untouched. Returns the model and
+# the layer cells, innermost first.
+def build_layered_sphere_model(material, max_thickness, layer_thickness=1, inner_rad=INNER_RADIUS, particles=10000, batches=2,
+                               rel_err=None, max_batches=None):
+    n_layers = round(max_thickness / layer_thickness)
+    radii = [inner_rad + k * layer_thickness for k in range(n_layers + 1)]
+    material = material.clone()
+    material.volume = (4/3) * math.pi * (radii[-1]**3 - inner_rad ** 3)
+    material.depletable = True
+    materials = openmc.Materials([material])
+
+    spheres = [openmc.Sphere(r=r) for r in radii]
+    spheres[-1].boundary_type = 'reflective'
+    layer_cells = []
+    for inner, outer in zip(spheres[:-1], spheres[1:]):
+        cell = openmc.Cell(region=+inner & -outer)
+        cell.fill = material
+        layer_cells.append(cell)
+    void_cell = openmc.Cell(region=-spheres[0])
+    void_cell.fill = None
+    geometry = openmc.Geometry(layer_cells + [void_cell])
+
+    settings = fixed_source_settings(point_source(), particles, batches, max_batches)
+    tallies = create_full_run_tallies(material, rel_err)
+    return openmc.model.Model(geometry, materials, settings, tallies), layer_cells
+
+# Ring in the z=0 plane around the point source, as tall as it is thick.
+# With biased_source the source only emits towards the ring (see
+# ring_band_source) and ring_source_fraction gives the source rate scaling.
+# zones splits the ring radially as in build_sphere_model.
+def build_ring_model(material, thickness=1, inner_rad=INNER_RADIUS, particles=10000, batches=2, rel_err=None,
+                     max_batches=None, biased_source=False, zones=1):
+    radii = zone_radii(inner_rad, thickness, zones)
+    volumes = [thickness * math.pi * (outer**2 - inner ** 2) for inner, outer in zip(radii[:-1], radii[1:])]
+    materials = openmc.Materials(zone_materials(material, volumes))
+
+    outer_sphere = openmc.Sphere(r=radii[-1], boundary_type='vacuum')
+    cylinders = [openmc.ZCylinder(r=r) for r in radii]
+    cylinders[-1].boundary_type = 'reflective'
+    bottom_plane = openmc.ZPlane(z0=0)
+    top_plane = openmc.ZPlane(z0=thickness)
+
+    ring_region = +cylinders[0] & -cylinders[-1] & +bottom_plane & -top_plane
+    zone_cells = []
+    for inner, outer, zone_material in zip(cylinders[:-1], cylinders[1:], materials):
+        cell = openmc.Cell(region=+inner & -outer & +bottom_plane & -top_plane)
+        cell.fill = zone_material
+        zone_cells.append(cell)
+    void_cell = openmc.Cell(region=-outer_sphere & ~ring_region)
+    void_cell.fill = None
+    geometry = openmc.Geometry(zone_cells + [void_cell])
+
+    source = ring_band_source(inner_rad, thickness)[0] if biased_source else point_source()
+    settings = fixed_source_settings(source, particles, batches, max_batches)
+    tallies = create_full_run_tallies(zone_cells, rel_err)
+    return openmc.model.Model(geometry, materials, settings, tallies), zone_cells[0] if zones == 1 else zone_cells
+
+def ring_source_fraction(thickness=1, inner_rad=INNER_RADIUS, biased_source=True):
+    return ring_band_source(inner_rad, thickness)[1] if biased_source else 1.0
+
+MODEL_BUILDERS = {
+    'sphere': build_sphere_model,
+    'ring': build_ring_model,
+}
+
+def build_model(material, geometry='sphere', thickness=1, **kwargs):
+    return MODEL_BUILDERS[geometry](material, thickness, **kwargs)
+
+def _render_geometry_view(geometry, colors, basis, path):
+    import matplotlib
+    matplotlib.use('Agg')
+    plot = geometry.plot(basis=basis, color_by='cell', colors=colors)
+    plot.figure.savefig(path)
+
+# Writes {basis}-cell.png for each view into `directory`. Images are cached
+# under a hash of the geometry XML and colour map, so an unchanged geometry is
+# copied from the cache instead of re-rendered. Missing views are rendered in
+# forked processes, one per view (the run scripts have no __main__ guard, so
+# spawn is not an option); without fork they are rendered in turn.
+def plot_geometry_views(geometry, colors, directory='.', bases=PLOT_BASES):
+    fd, xml_path = tempfile.mkstemp(suffix='.xml')
+    os.close(fd)
+    try:
+        geometry.export_to_xml(xml_path)
+        key = file_hash(xml_path, sorted((cell.id, repr(color)) for cell, color in colors.items()))
+    finally:
+        os.remove(xml_path)
+
+    plot_dir = cache_dir() / f"geometry_plots_{key}"
+    plot_dir.mkdir(exist_ok=True)
+    missing = [basis for basis in bases if not (plot_dir / f"{basis}-cell.png").exists()]
+    if missing:
+        render_dir = Path(tempfile.mkdtemp(dir=plot_dir))
+        jobs = [(geometry, colors, basis, render_dir / f"{basis}-cell.png") for basis in missing]
+        if 'fork' in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(len(jobs), mp_context=multiprocessing.get_context('fork')) as pool:
+                for future in [pool.submit(_render_geometry_view, *job) for job in jobs]:
+                    future.result()
+        else:
+            for job in jobs:
+                _render_geometry_view(*job)
+        for basis in missing:
+            os.replace(render_dir / f"{basis}-cell.png", plot_dir / f"{basis}-cell.png")
+        shutil.rmtree(render_dir)
+
+    for basis in bases:
+        shutil.copy(plot_dir / f"{basis}-cell.png", Path(directory) / f"{basis}-cell.png")
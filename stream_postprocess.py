@@ -0,0 +1,156 @@
+# Post-processes a depletion run while it is still going: a background thread
+# polls the run directory for new depletion_results.h5 rows and new
+# openmc_simulation_n{i}.h5 statepoints and appends each new step to the .out
+# report and a tab-separated classification table as soon as it is saved.
+# Only new rows are read, so by the time integrate() returns the report is
+# finished up to the last step.
+import threading
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+from openmc.deplete import StepResult
+
+from dot_out_generator import (load_decay_table, decay_properties, waste_limit_matrix, waste_fractions, classify_waste,
+                               format_depletion_step, read_statepoint_file, statepoint_path, WASTE_CLASSES)
+from depletion_tools import results_lock
+from run_trace import span, count
+
+STREAM_TALLIES = ('damage_energy', 'heat', 'dose_rate')
+
+# The results file is only read under depletion_tools.results_lock. While the
+# stream runs, StepResult.save takes the same lock (append_decay_steps always
+# does), so every row read has been written and the writer has closed the
+# file; HDF5 would otherwise refuse either side's open. A results file older
+# than the stream is left over from an earlier run and is ignored until the
+# new run overwrites it. openmc writes statepoints in place, so step i's
+# statepoint is only opened once row i is saved, which happens after it is
+# written. Tally values in the table are multiplied by tally_scale, e.g. the
+# source fraction of a biased source.
+class StreamingReport:
+    def __init__(self, directory='.', out_file='v.out', class_file='waste_classes.tsv', material_id=None,
+                 chain_file=None, tally_names=STREAM_TALLIES, tally_scale=1.0, poll_interval=1.0):
+        self.directory = Path(directory)
+        self.results_file = self.directory / "depletion_results.h5"
+        self.out_path = self.directory / out_file
+        self.class_path = self.directory / class_file
+        self.material_id = material_id
+        self.table = load_decay_table(chain_file)
+        self.tally_names = tally_names
+        self.tally_scale = tally_scale
+        self.poll_interval = poll_interval
+
+        self.started = time.time()
+        self.nuclides = None
+        self.times = []
+        self.fractions = []
+        self.codes = []
+        self._prev_time = 0
+        self._stop = threading.Event()
+        self._saved = threading.Event()
+        self._thread = None
+        self._save = None
+
+        with open(self.out_path, 'w'), open(self.class_path, 'w') as class_table:
+            class_table.write("\t".join(("step", "time_s", "class", "slc_a", "slc_b", "slc_c", "llc") + tuple(tally_names)) + "\n")
+
+    def start(self):
+        save = StepResult.save
+        def locked_save(*args, **kwargs):
+            with results_lock:
+                save(*args, **kwargs)
+            self._saved.set()
+        self._save = save
+        StepResult.save = staticmethod(locked_save)
+        self._thread = threading.Thread(target=self._run, name='streaming-report', daemon=True)
+        self._thread.start()
+        return self
+
+    # Stops polling, restores StepResult.save and processes whatever is left
+    def stop(self):
+        self._stop.set()
+        self._saved.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._save is not None:
+            StepResult.save = staticmethod(self._save)
+            self._save = None
+        self.poll()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Wakes on each save, or every poll_interval for the decay-only steps
+    def _run(self):
+        while not self._stop.is_set():
+            self._saved.wait(self.poll_interval)
+            self._saved.clear()
+            if not self._stop.is_set():
+                self.poll()
+
+    def _is_current(self, path):
+        return path.exists() and path.stat().st_mtime >= self.started
+
+    def poll(self):
+        with results_lock:
+            if not self._is_current(self.results_file):
+                return
+            with h5py.File(self.results_file, 'r') as f:
+                if self.nuclides is None:
+                    self._setup(f)
+                start, stop = len(self.times), f['time'].shape[0]
+                if stop <= start:
+                    return
+                with span('stream steps', start=start, stop=stop):
+                    times = f['time'][start:stop, 0]
+                    source_rates = f['source_rate'][start:stop, 0]
+                    atoms = f['number'][start:stop, 0, self.mat_index, :][:, self.columns]
+        self._process(start, times, source_rates, atoms)
+
+    def _setup(self, f):
+        materials = f['materials']
+        material_id = self.material_id if self.material_id is not None else next(iter(materials))
+        material = materials[str(material_id)]
+        self.mat_index = material.attrs['index']
+        self.volume = material.attrs['volume']
+        columns = {name: group.attrs['atom number index'] for name, group in f['nuclides'].items()}
+        self.nuclides = sorted(columns, key=columns.get)
+        self.columns = np.array([columns[name] for name in self.nuclides], dtype=int)
+        self.decay = decay_properties(self.table, self.nuclides)
+        self.inverse_limits = waste_limit_matrix(self.nuclides, self.decay['half_life'])
+
+    # Tally totals of one saved step, or {} when its statepoint cannot be read
+    # (the table then leaves them blank)
+    def _step_tallies(self, step):
+        try:
+            values = read_statepoint_file(statepoint_path(self.directory, step), self.tally_names)
+        except (OSError, KeyError) as e:
+            print(f"Streaming report: no tallies for step {step} ({e})")
+            count('stream statepoint failures')
+            return {}
+        return {name: values[name][0].sum() * self.tally_scale for name in self.tally_names}
+
+    # Only steps with a nonzero source rate get tallies (see
+    # transport_statepoints)
+    def _process(self, start, times, source_rates, atoms):
+        fractions = waste_fractions(atoms, self.decay['decay_constant'], self.volume, self.inverse_limits)
+        codes = classify_waste(fractions)
+        with open(self.out_path, 'a') as out, open(self.class_path, 'a') as class_table:
+            for k, time_s in enumerate(times):
+                i = start + k
+                time_h = time_s / 3600
+                out.write(format_depletion_step(i, time_h, self._prev_time, self.nuclides, atoms[k], self.decay,
+                                                WASTE_CLASSES[codes[k]]))
+                self._prev_time = time_h
+                tallies = self._step_tallies(i) if source_rates[k] != 0 else {}
+                row = [str(i), f"{time_s:g}", WASTE_CLASSES[codes[k]]] + [f"{value:g}" for value in fractions[k]]
+                row += [f"{tallies[name]:g}" if name in tallies else "" for name in self.tally_names]
+                class_table.write("\t".join(row) + "\n")
+        self.times.extend(times)
+        self.fractions.extend(fractions)
+        self.codes.extend(codes)
+        count('stream steps', len(times))
@@ -0,0 +1,91 @@
+# Two-stage transport for the shell models: the neutrons reaching the inner
+# surface of the shell are recorded once with a void-only model, then that
+# surface source is replayed as the source of every material, thickness and
+# schedule variant. Recorded banks are cached on disk by run parameters, so
+# sweep cases on the same geometry share one upstream run.
+import os
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import h5py
+import numpy as np
+import openmc
+
+from dot_out_generator import cache_dir, file_hash, openmc_version
+from run_trace import traced, count
+from shell_models import INNER_RADIUS, point_source, fixed_source_settings, build_model
+
+# Stage one: the void inside the shell with vacuum boundaries, recording every
+# crossing of the shell's inner surface. Each source neutron crosses it at
+# most once, so the bank holds at most particles * batches entries.
+def surface_source_model(geometry='sphere', thickness=1, inner_rad=INNER_RADIUS, particles=10000, batches=2):
+    if geometry == 'sphere':
+        inner_surface = openmc.Sphere(r=inner_rad, boundary_type='vacuum')
+        void_cell = openmc.Cell(region=-inner_surface)
+    else:
+        # The ring model's void ends at a sphere of the outer radius, which
+        # cuts off the inner cylinder too
+        inner_surface = openmc.ZCylinder(r=inner_rad, boundary_type='vacuum')
+        outer_sphere = openmc.Sphere(r=inner_rad + thickness, boundary_type='vacuum')
+        void_cell = openmc.Cell(region=-inner_surface & -outer_sphere)
+    void_cell.fill = None
+
+    settings = fixed_source_settings(point_source(), particles, batches)
+    settings.surf_source_write = {'surface_ids': [inner_surface.id], 'max_particles': particles * batches}
+    return openmc.model.Model(openmc.Geometry([void_cell]), openmc.Materials(), settings)
+
+# Structured array over the source_bank dataset of a surface_source.h5,
+# memory-mapped when the dataset is stored contiguously (as openmc writes it)
+# so large banks are not read into memory to count or inspect them.
+def load_source_bank(path):
+    with h5py.File(path, 'r') as f:
+        dataset = f['source_bank']
+        offset = dataset.id.get_offset()
+        if offset is None or dataset.compression is not None:
+            return dataset[()]
+        dtype, shape = dataset.dtype, dataset.shape
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+# Records (or reuses) the surface source for a geometry. Returns the path of
+# the bank and the weight scale n_banked / n_source: tallies per replayed
+# particle times this scale are tallies per neutron emitted by the point
+# source, so replay source rates are multiplied by it.
+@traced
+def cached_surface_source(geometry='sphere', thickness=1, inner_rad=INNER_RADIUS, particles=10000, batches=2):
+    # The key covers the exported settings, so changes to the source or
+    # settings built in shell_models invalidate old banks, and this module,
+    # which builds the void geometry. Only the ring's void depends on the
+    # thickness. The recorded surface's id is auto-assigned, so
+    # surf_source_write is left out.
+    model = surface_source_model(geometry, thickness, inner_rad, particles, batches)
+    settings_xml = model.settings.to_xml_element()
+    for element in settings_xml.findall('surf_source_write'):
+        settings_xml.remove(element)
+    key_thickness = thickness if geometry == 'ring' else None
+    key = file_hash(__file__, geometry, key_thickness, inner_rad, ET.tostring(settings_xml), openmc_version())
+    path = cache_dir() / f"surface_source_{key}.h5"
+    if path.exists():
+        count('surface source cache hits')
+    else:
+        count('surface source cache misses')
+        run_dir = Path(tempfile.mkdtemp(dir=path.parent, prefix='surface_source_'))
+        try:
+            model.run(cwd=run_dir, output=False)
+            os.replace(run_dir / 'surface_source.h5', path)
+        finally:
+            shutil.rmtree(run_dir)
+    n_banked = len(load_source_bank(path))
+    return str(path), n_banked / (particles * batches)
+
+# Shell model whose source is the recorded surface source instead of the
+# point source. Returns the model, the shell cell and the weight scale.
+def build_replay_model(material, geometry='sphere', thickness=1, inner_rad=INNER_RADIUS, particles=10000,
+                       batches=2, record_particles=None, **kwargs):
+    source_file, weight_scale = cached_surface_source(
+        geometry, thickness, inner_rad, record_particles or particles * batches, 1)
+    model, shell_cell = build_model(material, geometry, thickness, inner_rad=inner_rad, particles=particles,
+                                    batches=batches, **kwargs)
+    model.settings.source = openmc.FileSource(source_file)
+    return model, shell_cell, weight_scale
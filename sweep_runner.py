@@ -0,0 +1,197 @@
+# Runs a grid of material x geometry x thickness x schedule cases, each in its
+# own scratch directory on a process pool, and collects the outputs under one
+# directory with a sweep_summary.json.
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from shell_models import irradiation_schedule
+
+OUTPUT_PATTERNS = ('depletion_results.h5', 'openmc_simulation_n*.h5', '*.out', 'fluxes', '*.png')
+
+# rel_err and max_batches switch on tally triggers (see fixed_source_settings);
+# biased_source points the source of ring cases at the ring; surface_source
+# replays one recorded inner-surface source per geometry in every case; zones
+# splits each shell into that many radially depleted zones
+def sweep_cases(materials, geometries=('sphere', 'ring'), thicknesses=(1,), schedules=None, rel_err=None,
+                max_batches=None, biased_source=False, surface_source=False, zones=1):
+    if schedules is None:
+        schedules = {'1y_irradiation': irradiation_schedule()}
+    cases = []
+    for (material_name, material), geometry, thickness, (schedule_name, schedule) in itertools.product(
+            materials.items(), geometries, thicknesses, schedules.items()):
+        timesteps, source_rates = schedule
+        cases.append({
+            'name': f"{material_name}_{geometry}_{thickness:g}cm{f'_{zones}zones' if zones > 1 else ''}_{schedule_name}",
+            'material_name': material_name,
+            'material': material,
+            'geometry': geometry,
+            'thickness': thickness,
+            'schedule': schedule_name,
+            'timesteps': list(timesteps),
+            'source_rates': list(source_rates),
+            'rel_err': rel_err,
+            'max_batches': max_batches,
+            'biased_source': biased_source and geometry == 'ring',
+            'surface_source': surface_source,
+            'zones': zones,
+        })
+    return cases
+
+def _init_worker(threads):
+    # Must happen before openmc.lib is loaded in this process
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+def run_case(case, output_dir, scratch_root=None):
+    import openmc
+    import openmc.deplete
+    from dot_out_generator import (load_inventory, load_zone_inventories, load_decay_table, decay_properties,
+                                   write_out_report, write_zone_report, tally_precision, read_statepoint_tallies,
+                                   transport_statepoints, WASTE_CLASSES)
+    from shell_models import build_model, ring_source_fraction
+    from depletion_tools import cached_reduced_chain, integrate_with_decay_fast_path
+
+    # Single-zone cases deplete one material, so only zoned cases use
+    # openmc's pool to solve their zones in parallel
+    zones = case.get('zones', 1)
+    openmc.deplete.pool.USE_MULTIPROCESSING = zones > 1
+    openmc.deplete.pool.NUM_PROCESSES = min(zones, os.cpu_count() or 1)
+
+    scratch = Path(tempfile.mkdtemp(prefix=f"{case['name']}_", dir=scratch_root))
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        material = case['material']
+        model_kwargs = {'rel_err': case.get('rel_err'), 'max_batches': case.get('max_batches'), 'zones': zones}
+        source_fraction = 1.0
+        if case.get('surface_source'):
+            from surface_source import build_replay_model
+            model, shell_cell, source_fraction = build_replay_model(
+                material, case['geometry'], case['thickness'], **model_kwargs)
+        else:
+            if case.get('biased_source'):
+                model_kwargs['biased_source'] = True
+                source_fraction = ring_source_fraction(case['thickness'])
+            model, shell_cell = build_model(material, case['geometry'], case['thickness'], **model_kwargs)
+        operator = openmc.deplete.CoupledOperator(
+            model,
+            normalization_mode='source-rate',
+            chain_file=cached_reduced_chain(model.materials, openmc.config['chain_file'], reduce_chain_level=5),
+            reduce_chain=False
+        )
+        source_rates = [rate * source_fraction for rate in case['source_rates']]
+        integrate_with_decay_fast_path(operator, case['timesteps'], source_rates)
+
+        zone_classes = None
+        if zones > 1:
+            times, atoms, nuclide_index, volumes = load_zone_inventories(
+                "depletion_results.h5", [zone_material.id for zone_material in model.materials])
+            decay = decay_properties(load_decay_table(), list(nuclide_index))
+            with open(f"{case['name']}.out", 'w') as file:
+                waste_classes, zone_codes = write_zone_report(file, times, atoms, list(nuclide_index), decay, volumes)
+            zone_classes = [[WASTE_CLASSES[code] for code in codes] for codes in zone_codes]
+        else:
+            times, atoms, nuclide_index, volume = load_inventory("depletion_results.h5", material_id=material.id)
+            decay = decay_properties(load_decay_table(), list(nuclide_index))
+            with open(f"{case['name']}.out", 'w') as file:
+                fractions, waste_classes = write_out_report(file, times, atoms, list(nuclide_index), decay, volume)
+        transport_steps, statepoint_files = transport_statepoints(source_rates)
+        precision, batches = tally_precision(statepoint_files)
+
+        # Per step totals over the shell, per emitted neutron (biased and
+        # replayed sources score per particle of their own source);
+        # decay-only steps have none
+        activity = (atoms @ decay['decay_constant']).reshape(-1, len(times)).sum(axis=0)
+        step_tallies = {name: [None] * len(times) for name in ('heat', 'damage_energy')}
+        for name, (mean, std_dev, n_realizations) in read_statepoint_tallies(statepoint_files, tuple(step_tallies)).items():
+            for i, value in zip(transport_steps, mean.sum(axis=1)):
+                step_tallies[name][i] = float(value) * source_fraction
+    finally:
+        os.chdir(cwd)
+
+    case_dir = Path(output_dir) / case['name']
+    case_dir.mkdir(parents=True, exist_ok=True)
+    for pattern in OUTPUT_PATTERNS:
+        for path in scratch.glob(pattern):
+            shutil.move(path, case_dir / path.name)
+    shutil.rmtree(scratch)
+
+    return {
+        'name': case['name'],
+        'material': case['material_name'],
+        'geometry': case['geometry'],
+        'thickness': case['thickness'],
+        'schedule': case['schedule'],
+        'directory': str(case_dir),
+        'times': times.tolist(),
+        'waste_class': [WASTE_CLASSES[code] for code in waste_classes],
+        'zone_waste_class': zone_classes,
+        'zones': zones,
+        'activity': activity.tolist(),
+        'heat': step_tallies['heat'],
+        'damage_energy': step_tallies['damage_energy'],
+        'batches': batches.tolist(),
+        'relative_error': {name: rel_err.tolist() for name, rel_err in precision.items()},
+    }
+
+# threads_per_case * processes should not exceed the core count; processes
+# defaults to as many cases as fit. Zoned cases each run up to one depletion
+# process per zone, so the default also divides by the largest zone count.
+# With archive set, each finished case is also appended to that
+# results_archive file (float32 for single precision), and it is recorded in
+# the run_catalog database, by default in output_dir.
+def run_sweep(cases, output_dir, processes=None, threads_per_case=1, scratch_root=None, archive=None, float32=False,
+              catalog='run_catalog.sqlite'):
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if catalog is not None:
+        from run_catalog import record_run
+        catalog = output_dir / catalog
+    if processes is None:
+        zones = max((case.get('zones', 1) for case in cases), default=1)
+        processes = max(1, (os.cpu_count() or 1) // (threads_per_case * zones))
+
+    summaries = []
+    # spawn so workers start without an OpenMP runtime inherited from the parent
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                             initargs=(threads_per_case,)) as pool:
+        futures = {pool.submit(run_case, case, output_dir, scratch_root): case for case in cases}
+        for future in as_completed(futures):
+            case = futures[future]
+            try:
+                summary = future.result()
+                if archive is not None:
+                    from results_archive import archive_run
+                    parameters = {key: case[key] for key in ('material_name', 'geometry', 'thickness', 'schedule')}
+                    archive_run(archive, summary['directory'], case['name'], parameters, float32)
+                if catalog is not None:
+                    record_run(catalog, summary)
+                summaries.append(summary)
+            except Exception as e:
+                print(f"Case {case['name']} failed: {e}")
+                summaries.append({'name': case['name'], 'error': repr(e)})
+
+    summaries.sort(key=lambda summary: summary['name'])
+    with open(output_dir / 'sweep_summary.json', 'w') as file:
+        json.dump(summaries, file, indent=2)
+    return summaries
+
+if __name__ == '__main__':
+    import openmc
+
+    c = openmc.Material(name='C')
+    c.add_element('C', 1, percent_type='ao')
+    c.set_density('g/cm3', 2.26)
+
+    v = openmc.Material(name='V')
+    v.add_element('V', 1, percent_type='ao')
+    v.set_density('g/cm3', 6.1)
+
+    cases = sweep_cases({'C': c, 'V': v}, geometries=('sphere', 'ring'), thicknesses=(1,))
+    run_sweep(cases, 'sweep_output')
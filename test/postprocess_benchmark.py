@@ -0,0 +1,138 @@
+# Times each post-processing stage against the checked-in HDF5 fixtures:
+# results loading, statepoint tally reads, decay data lookups, classification
+# and .out formatting. The fixture depletion results are also tiled out to 40
+# and 400 steps (with as many statepoint reads) to see how each stage scales.
+#
+# Per-stage times are compared against postprocess_baseline.json next to this
+# script; a stage slower than tolerance x its baseline fails the run, and so
+# does a missing baseline.
+#
+#   python test/postprocess_benchmark.py                    # check
+#   python test/postprocess_benchmark.py --update-baseline  # record
+
+import argparse
+import io
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from dot_out_generator import (load_inventory, read_statepoint_tallies, load_decay_table, decay_properties,
+                               waste_limit_matrix, waste_fractions, classify_waste, write_out_report)
+
+BASELINE_FILE = Path(__file__).resolve().parent / "postprocess_baseline.json"
+FIXTURE_RESULTS = ROOT / "depletion_results.h5"
+FIXTURE_STATEPOINTS = sorted(ROOT.glob("openmc_simulation_n*.h5"))
+STEP_COUNTS = (40, 400)
+FIXTURE_TALLIES = ('RR',)
+
+# Writes a copy of the results file with the fixture rows repeated out to
+# n_steps, times continuing from the last fixture step.
+def tile_results(results_file, n_steps, path):
+    shutil.copy(results_file, path)
+    with h5py.File(path, 'r+') as f:
+        n_fixture = f['time'].shape[0]
+        rows = np.arange(n_steps) % n_fixture
+        span = f['time'][-1, 1] if f['time'][-1, 1] > 0 else f['time'][-1, 0]
+        offsets = (np.arange(n_steps) // n_fixture) * span
+        for name, dataset in f.items():
+            if isinstance(dataset, h5py.Dataset) and dataset.maxshape[0] is None:
+                data = dataset[()][rows]
+                if name == 'time':
+                    data = data + offsets[:, None]
+                dataset.resize(n_steps, axis=0)
+                dataset[()] = data
+    return path
+
+# Best of repeat timings of fn(), in seconds, and the value it returned
+def best_time(fn, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+def benchmark_case(results_file, statepoints, table, repeat):
+    timings = {}
+    timings['load_inventory'], (times, atoms, nuclide_index, volume) = best_time(
+        lambda: load_inventory(results_file), repeat)
+    nuclides = list(nuclide_index)
+    timings['read_statepoints'], _ = best_time(
+        lambda: read_statepoint_tallies(statepoints, FIXTURE_TALLIES), repeat)
+    if table is not None:
+        timings['decay_lookup'], decay = best_time(lambda: decay_properties(table, nuclides), repeat)
+    else:
+        decay = {'decay_constant': np.zeros(len(nuclides)), 'half_life': np.full(len(nuclides), np.nan),
+                 'atomic_mass': np.full(len(nuclides), np.nan), 'photon_energy': np.zeros(len(nuclides))}
+
+    def classify():
+        inverse_limits = waste_limit_matrix(nuclides, decay['half_life'])
+        return classify_waste(waste_fractions(atoms, decay['decay_constant'], volume, inverse_limits))
+    timings['classify'], _ = best_time(classify, repeat)
+    timings['write_out_report'], _ = best_time(
+        lambda: write_out_report(io.StringIO(), times, atoms, nuclides, decay, volume), repeat)
+    return timings
+
+# chain_file None is the default chain (OPENMC_CHAIN_FILE or openmc's config),
+# only looked up here so the other stages run without openmc
+def load_table(chain_file):
+    try:
+        return load_decay_table(chain_file)
+    except (ImportError, KeyError, FileNotFoundError, TypeError) as e:
+        print(f"No usable chain file ({e!r}), skipping decay_lookup")
+        return None
+
+def check_baseline(results, baseline, tolerance):
+    regressions = []
+    for case, timings in results.items():
+        for stage, seconds in timings.items():
+            reference = baseline.get(case, {}).get(stage)
+            if reference is not None and seconds > tolerance * reference:
+                regressions.append(f"{case} {stage}: {seconds * 1e3:.3f} ms vs baseline {reference * 1e3:.3f} ms")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=1.5, help="allowed slowdown factor per stage")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chain-file', default=None, help="defaults to the configured chain")
+    args = parser.parse_args()
+
+    table = load_table(args.chain_file)
+    with h5py.File(FIXTURE_RESULTS, 'r') as f:
+        n_fixture = f['time'].shape[0]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = {f"fixture_{n_fixture}_steps": (FIXTURE_RESULTS, FIXTURE_STATEPOINTS)}
+        for n_steps in STEP_COUNTS:
+            results_file = tile_results(FIXTURE_RESULTS, n_steps, Path(tmp) / f"results_{n_steps}.h5")
+            statepoints = [FIXTURE_STATEPOINTS[i % len(FIXTURE_STATEPOINTS)] for i in range(n_steps)]
+            cases[f"synthetic_{n_steps}_steps"] = (results_file, statepoints)
+        for case, (results_file, statepoints) in cases.items():
+            results[case] = benchmark_case(results_file, statepoints, table, args.repeat)
+            print(case)
+            for stage, seconds in results[case].items():
+                print(f"  {stage:<18}{seconds * 1e3:10.3f} ms")
+
+    if args.update_baseline:
+        with open(BASELINE_FILE, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline written to {BASELINE_FILE}")
+    elif BASELINE_FILE.exists():
+        with open(BASELINE_FILE) as file:
+            regressions = check_baseline(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        sys.exit(1 if regressions else 0)
+    else:
+        print(f"ERROR: no baseline at {BASELINE_FILE}, record one with --update-baseline", file=sys.stderr)
+        sys.exit(1)
@@ -2,10 +2,10 @@
 # This is an introduction task for the topic and for real inventory tracking
 # decay and material evolution would need to be considered.
 
-import re
-
+import h5py
+import numpy as np
 import openmc
-from openmc.data import ATOMIC_NUMBER, ATOMIC_SYMBOL
+from openmc.data import ATOMIC_SYMBOL
 from openmc.deplete.chain import REACTIONS
 
 # creates a material
@@ -35,11 +35,64 @@ settings.source = my_source
 # gets all the possible reactions like (n,2n), (n,p), (n,2a) etc
 reactions = list(REACTIONS.keys())
 
-# makes a tally for every nuclide in the material and every reaction
-rr_tally = openmc.Tally(name="RR")
-rr_tally.nuclides = material.get_nuclides()
-rr_tally.scores = reactions
-tallies = openmc.Tallies([rr_tally])
+
+# Reactions each nuclide can actually undergo below max_energy, read straight
+# from the cross section library: a score is kept if any of its MT numbers is
+# present for the nuclide with a nonzero cross section between its threshold
+# and max_energy. Returns nuclide -> list of scores.
+def reaction_prescreen(nuclides, scores, max_energy, cross_sections=None):
+    library = openmc.data.DataLibrary.from_xml(cross_sections or openmc.config["cross_sections"])
+    screened = {}
+    for nuclide in nuclides:
+        path = library.get_by_material(nuclide, data_type="neutron")["path"]
+        with h5py.File(path, "r") as f:
+            group = f[nuclide]
+            # 0K holds only the elastic data some libraries add, so take
+            # the first real temperature
+            temperature = next(t for t in group["energy"] if t != "0K")
+            energy = group["energy"][temperature][()]
+            viable = []
+            for score in scores:
+                for mt in REACTIONS[score].mts:
+                    name = f"reaction_{mt:03d}"
+                    if name not in group["reactions"]:
+                        continue
+                    xs = group["reactions"][name][temperature]["xs"]
+                    threshold_idx = xs.attrs["threshold_idx"]
+                    # grid points up to max_energy plus the next one, whose
+                    # value the cross section is interpolated towards
+                    n_below = np.searchsorted(energy[threshold_idx:threshold_idx + xs.shape[0]], max_energy, side="right")
+                    if n_below > 0 and np.any(xs[:n_below + 1] > 0):
+                        viable.append(score)
+                        break
+            screened[nuclide] = viable
+    return screened
+
+
+# One tally per distinct reaction set, holding every nuclide that shares it,
+# instead of one nuclides x all-scores tally that is mostly zeros
+def prescreened_tallies(screened):
+    groups = {}
+    for nuclide, scores in screened.items():
+        if scores:
+            groups.setdefault(tuple(scores), []).append(nuclide)
+    tallies = openmc.Tallies()
+    for k, (scores, nuclides) in enumerate(groups.items()):
+        tally = openmc.Tally(name=f"RR {k}")
+        tally.nuclides = nuclides
+        tally.scores = list(scores)
+        tallies.append(tally)
+    return tallies
+
+
+# makes one tally per group of nuclides sharing the reactions that are open
+# to them at the source energy
+max_source_energy = max(my_source.energy.x)
+screened = reaction_prescreen(material.get_nuclides(), reactions, max_source_energy)
+tallies = prescreened_tallies(screened)
+n_full = len(screened) * len(reactions)
+n_screened = sum(len(tally.nuclides) * len(tally.scores) for tally in tallies)
+print(f"Reaction pre-screen kept {n_screened} of {n_full} nuclide/reaction bins in {len(tallies)} tallies")
 
 # builds the model and runs it
 model = openmc.model.Model(geometry, materials, settings, tallies)
@@ -48,49 +101,56 @@ sp_filename = model.run()
 # gets the simulation results
 sp = openmc.StatePoint(sp_filename)
 
-# gets the tally
-tbr_tally = sp.get_tally(name="RR")
-
-# converts to a pandas dataframe for easy manipulation
-df = tbr_tally.get_pandas_dataframe()
-# sorts the reactions from highest to lowest
-df = df.sort_values("mean", ascending=False)
-
-# this loop goes through the reactions getting the reaction rate (mean) for each
-# nuclide (nuclide) and each reaction (score)
+# gathers the tallies back into one (nuclides x reactions) array of rates,
+# zero where a reaction was screened out
+nuclides = list(screened)
+scores = reactions
+rates = np.zeros((len(nuclides), len(scores)))
+for tally in tallies:
+    tally_rates = sp.get_tally(name=tally.name).mean.reshape(len(tally.nuclides), len(tally.scores))
+    rows = [nuclides.index(nuclide) for nuclide in tally.nuclides]
+    cols = [scores.index(score) for score in tally.scores]
+    rates[np.ix_(rows, cols)] = tally_rates
+
+
+# Parses nuclide names into arrays of atomic number (Z) and mass number (A)
+# once, so reactions can be applied to every nuclide as array arithmetic
+def nuclide_za(nuclides):
+    za = np.array([openmc.data.zam(nuclide)[:2] for nuclide in nuclides], dtype=int).reshape(-1, 2)
+    return za[:, 0], za[:, 1]
+
+
+# Product nuclide of every (nuclide, reaction) pair and the rate matrix
+# (nuclides x products) summing the reaction rates that make each product.
+# REACTIONS[score].dadz is the change in (mass number, atomic number), for
+# example (n,2n) is (-1, 0)
+def transmutation_rates(nuclides, scores, rates):
+    z, a = nuclide_za(nuclides)
+    dadz = np.array([REACTIONS[score].dadz for score in scores], dtype=int)
+    product_a = a[:, None] + dadz[:, 0]
+    product_z = z[:, None] + dadz[:, 1]
+
+    rows, cols = np.nonzero((rates != 0) & (product_z >= 0) & (product_a > 0))
+    keys = product_z[rows, cols] * 1000 + product_a[rows, cols]
+    product_keys, product_cols = np.unique(keys, return_inverse=True)
+    products = [f"{ATOMIC_SYMBOL[key // 1000]}{key % 1000}" for key in product_keys]
+
+    matrix = np.zeros((len(nuclides), len(products)))
+    np.add.at(matrix, (rows, product_cols), rates[rows, cols])
+    return products, matrix, (rows, cols, product_cols)
+
+
+products, product_rates, (rows, cols, product_cols) = transmutation_rates(nuclides, scores, rates)
+
+secondaries = [
+    f"+{'+'.join(REACTIONS[score].secondaries)}" if REACTIONS[score].secondaries else ""
+    for score in scores
+]
+
+# prints all the transmutations from the highest reaction rate to the lowest
 print("Reaction rates per source neutron")
-for index, row in df.iterrows():
-    if row["mean"] != 0.0:
-        score = row["score"]
-        nuclide = row["nuclide"]
-
-        # gets the reaction change in terms of delta atomic number (dA)
-        # and delta mass number (dZ). This is a tuple for example (n,2n) is
-        # (-1, 0) because the atomic number decrease by one and the mass number
-        # stays the same
-        dAdZ = REACTIONS[score].dadz
-
-        # gets the element symbol from the nuclide name for example Fe from Fe56
-        element_symbol = re.split("(\d+)", nuclide)[0]
-        # gets the Z number from the nuclide name for example 56 from Fe56
-        neutron_plus_proton_number = int(re.split("(\d+)", nuclide)[1])
-
-        # looks up the atomic number from the element symbol
-        proton_number = ATOMIC_NUMBER[element_symbol]
-
-        # increases the atomic and mass numbers according to the delta values
-        new_proton_number = proton_number + dAdZ[1]
-
-        new_neutron_plus_proton_number = neutron_plus_proton_number + dAdZ[0]
-        secondaries = REACTIONS[score].secondaries
-        secondaries_str = ""
-        if len(secondaries) > 0:
-            secondaries_str = f"+{'+'.join(secondaries)}"
-
-        # gets the element symbol of the potentially new element
-        new_element_symbol = ATOMIC_SYMBOL[new_proton_number]
-
-        # prints all the transmutations and the reaction rates
-        print(
-            f"{element_symbol}{neutron_plus_proton_number} -> {score} -> {new_element_symbol}{new_neutron_plus_proton_number}{secondaries_str} per source neutron {row['mean']}"
-        )
+for k in np.argsort(-rates[rows, cols], kind="stable"):
+    i, j = rows[k], cols[k]
+    print(
+        f"{nuclides[i]} -> {scores[j]} -> {products[product_cols[k]]}{secondaries[j]} per source neutron {rates[i, j]}"
+    )
@@ -0,0 +1,124 @@
+# Classifies the hand-written compositions in nuc_waste_test_mats (no
+# transport, pre-exposure inventory only) in one vectorised pass through the
+# dot_out_generator limit logic, checks each against the class in its comment
+# and times the run. With --synthetic N it also times N random compositions to
+# measure classification throughput.
+#
+#   python test/waste_class_benchmark.py [--synthetic 1000000]
+
+import argparse
+import ast
+import operator
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from dot_out_generator import (AVOGADRO, WASTE_CLASSES, load_decay_table, decay_properties, waste_limit_matrix,
+                               waste_fractions, classify_waste)
+
+CASES_FILE = Path(__file__).resolve().parents[1] / "nuc_waste_test_mats"
+
+# Nuclides with a short- or long-lived limit, traced into stable diluents
+SYNTHETIC_NUCLIDES = ['H3', 'C14', 'Co60', 'Ni59', 'Ni63', 'Nb94', 'Sr90', 'Tc99', 'Cs137', 'I129']
+SYNTHETIC_DILUENTS = ['Ni58', 'Ni60', 'Fe56']
+
+_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+# Numbers and + - * / only, e.g. "1-6e-8"
+def evaluate_number(expression):
+    def evaluate(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -evaluate(node.operand)
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+        raise ValueError(f"Unsupported expression: {expression}")
+    return float(evaluate(ast.parse(expression, mode='eval').body))
+
+def expected_class(label):
+    if label.startswith("Not"):
+        return len(WASTE_CLASSES) - 1
+    match = re.match(r"(Type|Class) ([ABC])\b", label)
+    return WASTE_CLASSES.index(match[2])
+
+def parse_cases(path=CASES_FILE):
+    cases = []
+    label = None
+    for line in open(path):
+        line = line.strip()
+        if line.startswith('#') and not line.startswith('##'):
+            label = line.lstrip('#').strip()
+        elif line.startswith('v = openmc.Material()'):
+            cases.append({'label': label, 'expected': expected_class(label), 'fractions': {}, 'density': None})
+        elif match := re.match(r"v\.add_nuclide\('(\w+)', (.+), percent_type='ao'\)", line):
+            cases[-1]['fractions'][match[1]] = evaluate_number(match[2])
+        elif match := re.match(r"v\.set_density\('g/cm3', (.+)\)", line):
+            cases[-1]['density'] = evaluate_number(match[1])
+    return cases
+
+# Atoms per cm^3 for atom fractions (compositions x nuclides) and densities
+# (g/cm^3), as Material.get_nuclide_atom_densities computes them.
+def atom_densities(fractions, densities, atomic_mass):
+    fractions = fractions / fractions.sum(axis=1, keepdims=True)
+    atoms_per_gram = AVOGADRO / (fractions @ atomic_mass)
+    return fractions * (densities * atoms_per_gram)[:, None]
+
+def classify_compositions(fractions, densities, nuclides, decay):
+    atoms = atom_densities(fractions, densities, decay['atomic_mass'])
+    inverse_limits = waste_limit_matrix(nuclides, decay['half_life'])
+    return classify_waste(waste_fractions(atoms, decay['decay_constant'], 1.0, inverse_limits))
+
+def case_arrays(cases):
+    nuclides = sorted({nuc for case in cases for nuc in case['fractions']})
+    fractions = np.array([[case['fractions'].get(nuc, 0.0) for nuc in nuclides] for case in cases])
+    densities = np.array([case['density'] for case in cases])
+    return nuclides, fractions, densities
+
+def run_cases(table):
+    cases = parse_cases()
+    nuclides, fractions, densities = case_arrays(cases)
+    decay = decay_properties(table, nuclides)
+
+    start = time.perf_counter()
+    codes = classify_compositions(fractions, densities, nuclides, decay)
+    elapsed = time.perf_counter() - start
+
+    failures = 0
+    for case, code in zip(cases, codes):
+        status = "ok" if code == case['expected'] else "FAIL"
+        failures += code != case['expected']
+        print(f"{status:4}  got {WASTE_CLASSES[code]:<5.5}  expected {WASTE_CLASSES[case['expected']]:<5.5}  {case['label']}")
+    print(f"{len(cases)} cases classified in {elapsed * 1e3:.3f} ms, {failures} failures")
+    return failures
+
+def run_synthetic(table, n, seed=0):
+    rng = np.random.default_rng(seed)
+    nuclides = SYNTHETIC_NUCLIDES + SYNTHETIC_DILUENTS
+    decay = decay_properties(table, nuclides)
+    traces = 10 ** rng.uniform(-16, -6, size=(n, len(SYNTHETIC_NUCLIDES)))
+    fractions = np.hstack([traces, rng.uniform(0, 1, size=(n, len(SYNTHETIC_DILUENTS)))])
+    densities = rng.uniform(2, 9, size=n)
+
+    start = time.perf_counter()
+    codes = classify_compositions(fractions, densities, nuclides, decay)
+    elapsed = time.perf_counter() - start
+    counts = np.bincount(codes, minlength=len(WASTE_CLASSES))
+    print(f"{n} synthetic compositions classified in {elapsed:.3f} s ({n / elapsed:.3g} per second)")
+    print("  " + ", ".join(f"{name[:5]}: {count}" for name, count in zip(WASTE_CLASSES, counts)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synthetic', type=int, default=0, help="number of random compositions to time")
+    parser.add_argument('--chain-file', default=None)
+    args = parser.parse_args()
+
+    table = load_decay_table(args.chain_file)
+    failures = run_cases(table)
+    if args.synthetic:
+        run_synthetic(table, args.synthetic)
+    sys.exit(1 if failures else 0)
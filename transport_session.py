@@ -0,0 +1,132 @@
+# Keeps one openmc.lib instance alive across many transport runs of the shell
+# models, so nuclear data is loaded once and only the material composition or
+# shell thickness changes between runs.
+import math
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import openmc
+import openmc.lib
+
+from dot_out_generator import RUN_TALLIES
+from shell_models import INNER_RADIUS, build_layered_sphere_model, build_ring_model
+
+@contextmanager
+def _working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+# Sphere thicknesses are changed in memory by filling or voiding layers of a
+# shell built out to max_thickness, so they must be multiples of
+# layer_thickness. openmc.lib cannot move surfaces, so a ring thickness change
+# finalizes and re-initializes with a rebuilt model instead.
+class TransportSession:
+    def __init__(self, material, geometry='sphere', thickness=1, max_thickness=10, layer_thickness=1,
+                 inner_rad=INNER_RADIUS, particles=10000, batches=2, threads=None, directory=None):
+        self.material = material
+        self.geometry = geometry
+        self.max_thickness = max_thickness
+        self.layer_thickness = layer_thickness
+        self.inner_rad = inner_rad
+        self.particles = particles
+        self.batches = batches
+        self.threads = threads
+        self.directory = Path(directory or tempfile.mkdtemp(prefix='openmc_session_'))
+        self.thickness = None
+        self.densities = None
+        self._initialize(thickness)
+
+    def _initialize(self, thickness):
+        with _working_directory(self.directory):
+            if self.geometry == 'sphere':
+                model, self.layer_cells = build_layered_sphere_model(
+                    self.material, self.max_thickness, self.layer_thickness, self.inner_rad, self.particles, self.batches)
+            else:
+                model, shell_cell = build_ring_model(
+                    self.material, thickness, self.inner_rad, self.particles, self.batches)
+                self.layer_cells = [shell_cell]
+            model.export_to_xml()
+            # The sphere model fills its layers with a clone of self.material
+            self.material_id = model.materials[0].id
+            self.tally_ids = {tally.name: tally.id for tally in model.tallies}
+            args = ['-s', str(self.threads)] if self.threads else None
+            openmc.lib.init(args=args, output=False)
+        if self.densities is not None:
+            self._apply_densities()
+        self.thickness = thickness if self.geometry == 'ring' else None
+        self.set_thickness(thickness)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        openmc.lib.finalize()
+
+    @property
+    def volume(self):
+        outer_rad = self.inner_rad + self.thickness
+        if self.geometry == 'sphere':
+            return (4/3) * math.pi * (outer_rad**3 - self.inner_rad ** 3)
+        return self.thickness * math.pi * (outer_rad**2 - self.inner_rad ** 2)
+
+    def set_thickness(self, thickness):
+        if thickness == self.thickness:
+            return
+        if self.geometry == 'ring':
+            openmc.lib.finalize()
+            self._initialize(thickness)
+            return
+        n_layers = round(thickness / self.layer_thickness)
+        if not math.isclose(n_layers * self.layer_thickness, thickness) or not 0 < n_layers <= len(self.layer_cells):
+            raise ValueError(f"Thickness {thickness} cm is not a multiple of {self.layer_thickness} cm "
+                             f"up to {self.max_thickness} cm")
+        lib_material = openmc.lib.materials[self.material_id]
+        for k, cell in enumerate(self.layer_cells):
+            openmc.lib.cells[cell.id].fill = lib_material if k < n_layers else None
+        self.thickness = thickness
+
+    # Replaces the composition of the shell material in memory. Nuclides not
+    # in the initial composition are loaded on demand.
+    def set_material(self, material):
+        self.densities = material.get_nuclide_atom_densities()
+        self._apply_densities()
+
+    def _apply_densities(self):
+        for nuclide in self.densities:
+            if nuclide not in openmc.lib.nuclides:
+                openmc.lib.load_nuclide(nuclide)
+        openmc.lib.materials[self.material_id].set_densities(
+            list(self.densities), np.array(list(self.densities.values())))
+
+    # Runs transport with the current state and returns name -> (mean,
+    # std_dev) for the run tallies, flattened like read_statepoint_file.
+    def run(self):
+        with _working_directory(self.directory):
+            openmc.lib.reset()
+            openmc.lib.run(output=False)
+        values = {}
+        for name in RUN_TALLIES:
+            tally = openmc.lib.tallies[self.tally_ids[name]]
+            values[name] = (tally.mean.ravel(), tally.std_dev.ravel())
+        return values
+
+if __name__ == '__main__':
+    graphite = openmc.Material()
+    graphite.add_element('C', 1, percent_type='ao')
+    graphite.set_density('g/cm3', 2.26)
+
+    with TransportSession(graphite, 'sphere', thickness=1, max_thickness=5) as session:
+        for thickness in range(1, 6):
+            session.set_thickness(thickness)
+            values = session.run()
+            print(f"{thickness} cm: heating {values['heat'][0].sum():g} per source particle")